@@ -0,0 +1,20 @@
+"""
+asr_utils.py
+FunASR 推理配置（各 fun_asr 脚本共用）：
+- 推理精度与编译开关（环境变量）
+- 按需用 torch.compile 编译编码器
+"""
+import os
+
+import torch
+
+ASR_PRECISION = os.environ.get("ASR_PRECISION", "fp16")  # GPU推理精度：fp16 / fp32（CPU始终为fp32）
+ASR_COMPILE = os.environ.get("ASR_COMPILE") == "1"  # 是否用 torch.compile 编译编码器（仅GPU，默认关闭）
+
+
+def compile_encoder(model, device):
+    """按需用 torch.compile 编译paraformer编码器，减少逐算子调度开销"""
+    if not (ASR_COMPILE and device.startswith("cuda")):
+        return
+    # 音频长度各不相同，使用动态形状编译，避免每种长度都重新编译
+    model.model.encoder = torch.compile(model.model.encoder, dynamic=True)
@@ -1,14 +1,15 @@
 import os
 import sys
 
+from walk_utils import parallel_walk
+
 
 def delete_video_files(root_dir):
-    for dirpath, _, filenames in os.walk(root_dir):
+    for dirpath, _, filenames in parallel_walk(root_dir):
         video_path = os.path.join(dirpath, 'video.mp4')
-        audio_path = os.path.join(dirpath, 'audio.wav')
 
-        # 检查两个文件是否同时存在
-        if os.path.isfile(video_path) and os.path.isfile(audio_path):
+        # 检查两个文件是否同时存在（直接查扫描结果，免去逐个stat）
+        if 'video.mp4' in filenames and 'audio.wav' in filenames:
             try:
                 os.remove(video_path)
                 print(f"已删除： {video_path}")
@@ -0,0 +1,114 @@
+"""
+ffmpeg_utils.py
+视频转音频工具（mp4_2_wav 脚本与服务共用）：
+- 直接调用FFmpeg抽取音轨，跳过视频解码
+- 一次scandir查找目录中待转换的视频
+- 多个视频合并到一个ffmpeg进程转换，失败时逐个重试
+"""
+import logging
+import os
+import subprocess
+
+from moviepy import config
+
+# 配置参数
+VIDEO_NAME = "video"  # 主视频文件名（不含扩展）
+AUDIO_NAME = "audio.wav"
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
+AUDIO_SAMPLE_RATE = 16000  # 与下游FunASR模型一致（16k单声道）
+AUDIO_CHANNELS = 1
+FFMPEG_TIMEOUT = 600  # 单个文件转换超时（秒）
+FFMPEG_GROUP_SIZE = 8  # 单个ffmpeg进程最多同时转换的文件数
+AUDIO_OUTPUT_ARGS = ["-ac", str(AUDIO_CHANNELS), "-ar", str(AUDIO_SAMPLE_RATE), "-acodec", "pcm_s16le"]
+CONVERT_WORKERS = max(1, (os.cpu_count() or 2) // 2)  # 并发转换数
+
+
+def convert_video_to_audio(video_path, audio_path):
+    """核心转换逻辑：直接调用FFmpeg抽取音轨，跳过视频解码"""
+    cmd = [
+        config.FFMPEG_BINARY or "ffmpeg",
+        "-y", "-nostdin",
+        "-loglevel", "error",
+        "-i", video_path,
+        "-vn",
+        *AUDIO_OUTPUT_ARGS,
+        audio_path
+    ]
+    try:
+        subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        return True
+    except Exception as e:
+        detail = e.stderr if isinstance(e, subprocess.CalledProcessError) and e.stderr else str(e)
+        logging.error(f"转换失败：{video_path} - {detail.strip()}")
+        # 清理不完整的输出，避免下次被误判为已转换
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+        return False
+
+
+def find_conversion(folder_path):
+    """查找目录中待转换的视频，返回 (源视频, 目标音频)，无需转换时返回None"""
+    # 一次scandir得到全部目录项，音频检查与视频查找共用，不再逐个stat
+    with os.scandir(folder_path) as it:
+        entries = {entry.name.lower(): entry for entry in it}
+
+    # 检查目标音频文件存在性
+    target_audio = os.path.join(folder_path, AUDIO_NAME)
+    audio_entry = entries.get(AUDIO_NAME.lower())
+    if audio_entry is not None and audio_entry.is_file():
+        logging.debug(f"跳过目录：{folder_path}（{AUDIO_NAME}已存在）")
+        return None
+
+    # 查找视频文件
+    video_files = [
+        entry.path for name, entry in entries.items()
+        if name.startswith(VIDEO_NAME.lower())
+           and name.endswith(VIDEO_EXTS)
+    ]
+
+    if not video_files:
+        return None
+
+    # 处理第一个符合条件的视频文件
+    return video_files[0], target_audio
+
+
+def convert_task(task):
+    """转换单个 (源视频, 目标音频) 任务"""
+    source_video, target_audio = task
+    logging.debug(f"开始转换：{source_video}")
+    return convert_video_to_audio(source_video, target_audio)
+
+
+def convert_group(group):
+    """一个ffmpeg进程同时转换多个视频（多输入、多输出），摊薄进程启动开销；返回成功数量"""
+    if len(group) == 1:
+        return int(convert_task(group[0]))
+
+    cmd = [config.FFMPEG_BINARY or "ffmpeg", "-y", "-nostdin", "-loglevel", "error"]
+    for source_video, _ in group:
+        cmd += ["-i", source_video]
+    for i, (_, target_audio) in enumerate(group):
+        cmd += ["-map", f"{i}:a:0", *AUDIO_OUTPUT_ARGS, target_audio]
+
+    try:
+        subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT * len(group),
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return len(group)
+    except Exception as e:
+        # 任一文件出错整组失败，逐个重试以定位并清理问题文件
+        logging.debug(f"分组转换失败，改为逐个转换：{str(e)}")
+        return sum(1 for task in group if convert_task(task))
+
+
+def split_groups(tasks):
+    """按分组大小切分任务，文件较少时缩小分组以保证所有工作线程都有活干"""
+    size = max(1, min(FFMPEG_GROUP_SIZE, len(tasks) // CONVERT_WORKERS))
+    return [tasks[i:i + size] for i in range(0, len(tasks), size)]
+
+
+def process_directory(folder_path):
+    """处理单个目录"""
+    task = find_conversion(folder_path)
+    return convert_task(task) if task else False
@@ -0,0 +1,126 @@
+"""
+font_utils.py
+字体工具（各 txt2pdf 脚本共用）：
+- 候选字体列表，存在性每个进程只检测一次
+- 字体字符表读取与缓存
+- FontRoutingMixin：按字符选择字体，后备字体用到时才注册
+"""
+import logging
+import os
+from functools import lru_cache
+
+from fontTools.ttLib import TTFont
+
+# 候选字体均按优先级排列
+# 图文脚本（txt2pdf_addpic*）：先emoji字体，再中文字体
+TEXT_FONT_CANDIDATES = (
+    ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
+    ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
+    ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
+    ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
+    ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
+    ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf")),
+)
+# 视频脚本（txt2pdf_with_video*）：macOS系统中文字体优先
+VIDEO_FONT_CANDIDATES = (
+    ("NotoSansCJKsc", "/System/Library/Fonts/Supplemental/NotoSansCJKsc-Regular.ttf"),
+    ("PingFang", "/System/Library/Fonts/PingFang.ttc"),
+    ("Arial", "/Library/Fonts/Arial.ttf"),
+    ("ArialUnicode", "/System/Library/Fonts/Arial Unicode.ttf"),
+    ("Symbola", "/Library/Fonts/Symbola.ttf"),
+    ("NotoColorEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
+    ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
+    ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
+    ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
+    ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
+    ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
+    ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf")),
+)
+
+
+@lru_cache(maxsize=None)
+def available_font_paths(candidates):
+    """返回候选字体中实际存在的 (名称, 路径)；同一组候选在进程内只stat一次"""
+    return tuple((name, path) for name, path in candidates if os.path.exists(path))
+
+
+@lru_cache(maxsize=None)
+def load_font_cmap(font_path):
+    """读取字体支持的码位集合（失败返回None），按路径缓存，进程内只解析一次"""
+    try:
+        with TTFont(font_path, fontNumber=0, lazy=True) as font:
+            return frozenset(font.getBestCmap())
+    except Exception as e:
+        logging.warning(f"字体字符表读取失败：{font_path} - {str(e)}")
+        return None
+
+
+class FontRoutingMixin:
+    """
+    PDFConverter 共用的字体选择逻辑（需提供 self.pdf）
+    - FONT_CANDIDATES：候选字体，按优先级排列
+    - FONT_STYLES：每个字体注册的字形
+    - PREFERRED_FONTS：优先作为主字体的字体
+    """
+    FONT_CANDIDATES = ()
+    FONT_STYLES = ("",)
+    PREFERRED_FONTS = ()
+
+    def _reset_fonts(self):
+        """清空字体状态（新文档须重新注册字体）"""
+        self.current_font = None
+        self.available_fonts = []
+        self._font_cmaps = {}
+        self._font_paths = {}
+        self._registered_fonts = set()
+
+    def _collect_fonts(self):
+        """收集可用字体及其字符表，此时不注册"""
+        for name, path in available_font_paths(self.FONT_CANDIDATES):
+            if name not in self._font_paths:  # 同名字体取优先级高者
+                self._font_paths[name] = path
+                self._font_cmaps[name] = load_font_cmap(path)
+                self.available_fonts.append(name)
+
+    def _primary_font(self):
+        """主字体：先按 PREFERRED_FONTS，再按优先级取第一个能成功注册的字体；均失败时返回None"""
+        return next((f for f in [*self.PREFERRED_FONTS, *self.available_fonts] if self._register_font(f)), None)
+
+    def _register_font(self, name):
+        """向当前文档注册字体（fpdf2 注册时解析整个TTF，只注册实际用到的字体），失败时移出候选"""
+        if name in self._registered_fonts:
+            return True
+        if name not in self._font_paths:
+            return False
+        path = self._font_paths[name]
+        try:
+            for style in self.FONT_STYLES:
+                self.pdf.add_font(name, style=style, fname=path, uni=True)
+        except Exception as e:
+            logging.warning(f"字体加载失败：{name} - {str(e)}")
+            del self._font_paths[name]
+            self.available_fonts.remove(name)
+            return False
+        self._registered_fonts.add(name)
+        return True
+
+    def _font_for_char(self, char):
+        """返回能渲染该字符的字体：主字体优先，否则按优先级注册第一个覆盖该字符的字体；均不支持时返回None"""
+        code = ord(char)
+        for font in (self.current_font, *self.available_fonts):
+            cmap = self._font_cmaps.get(font)
+            if (cmap is None or code in cmap) and self._register_font(font):  # 字符表未知时视为支持
+                return font
+        return None
+
+    def _sanitize_text(self, text):
+        """去除回车，将所有字体都不支持的字符替换为�，并按需注册后备字体"""
+        table = {ord('\r'): None}
+        for char in set(text) - {'\n', '\r'}:
+            if self._font_for_char(char) is None:
+                table[ord(char)] = '�'
+        # 当前字体缺字时由fpdf2自动切换到其他已注册字体
+        self.pdf.set_fallback_fonts(
+            [f for f in self.available_fonts if f in self._registered_fonts and f != self.current_font]
+        )
+        return text.translate(table)
@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
+# 须在导入torch之前设置：减少显存碎片，复用已分配的显存段
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "max_split_size_mb:512,expandable_segments:True")
 import uuid
 import logging
+import subprocess
+import wave
 from flask import Flask, request, jsonify
 from functools import lru_cache
+import numpy as np
 import torch
 import threading
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from funasr import AutoModel
 
+# fun_asr/ 下的脚本单独运行，需把上级目录加入搜索路径以复用公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from asr_utils import ASR_PRECISION, compile_encoder  # noqa: E402
+
 app = Flask(__name__)
 
 # 初始化锁和标志
@@ -15,13 +28,32 @@ init_lock = threading.Lock()
 initialized = False
 
 # 服务配置
-MAX_CONCURRENT_TASKS = 3
-MODEL_LOCK = threading.Lock()
+BATCH_SIZE = 16  # 每次 generate 的最大文件数
+MAX_WAIT_MS = 50  # 推理线程凑批的最长等待时间（毫秒）
+TASK_WORKERS = min(8, os.cpu_count() or 1)  # 同时执行的任务数（扫描、解码与写文件）
+WRITE_WORKERS = 4  # 结果写文件线程数
+BATCH_SIZE_S = 300  # VAD 分段批处理的总时长（秒）
+WARMUP_SECONDS = (1, 30)  # 预热音频时长（秒），覆盖短句与长分段
+
+# 视频直接转写配置
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+FFMPEG_TIMEOUT = 600  # 单个视频解码超时（秒）
+AUDIO_SAMPLE_RATE = 16000  # 模型输入采样率（单声道）
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
 
 # 任务状态存储
 tasks = {}
 task_progress = {}
 
+# 待转写队列：所有任务共享，由唯一的推理线程消费
+asr_queue = queue.Queue()
+
+# 任务线程池：替代每个请求单独起线程，超出上限的任务排队等待
+task_executor = ThreadPoolExecutor(max_workers=TASK_WORKERS)
+
+# 写文件线程池：结果写入与下一批推理重叠，网络卷上尤其明显
+write_executor = ThreadPoolExecutor(max_workers=WRITE_WORKERS)
+
 
 # 全局模型缓存
 funasr_models = {}
@@ -38,6 +70,11 @@ logging.basicConfig(
 
 def create_model():
     """带缓存的模型初始化"""
+    # 已加载时直接返回，跳过设备与模型路径检测
+    cached = funasr_models.get("zh")
+    if cached is not None:
+        return cached
+
     try:
         device = "cuda:0" if torch.cuda.is_available() else "cpu"
         logging.info(f"使用计算设备: {device}")
@@ -55,25 +92,32 @@ def create_model():
         path_punc = model_paths["punc"] if os.path.exists(
             model_paths["punc"]) else "iic/punc_ct-transformer_zh-cn-common-vocab272727-pytorch"
 
-        if "zh" not in funasr_models:
-            device = "cuda:0" if torch.cuda.is_available() else "cpu"
-            model = AutoModel(
-                model=path_asr,
-                vad_model=path_vad,
-                punc_model=path_punc,
-                model_revision="v2.0.4",
-                vad_model_revision="v2.0.4",
-                punc_model_revision="v2.0.4",
-                device=device,
-                vad_kwargs={"max_single_segment_time": 60000}
-            )
-            funasr_models["zh"] = model
-        return funasr_models["zh"]
+        model = AutoModel(
+            model=path_asr,
+            vad_model=path_vad,
+            punc_model=path_punc,
+            model_revision="v2.0.4",
+            vad_model_revision="v2.0.4",
+            punc_model_revision="v2.0.4",
+            device=device,
+            fp16=device.startswith("cuda") and ASR_PRECISION == "fp16",  # GPU上以FP16运行paraformer主模型
+            vad_kwargs={"max_single_segment_time": 60000}
+        )
+        compile_encoder(model, device)
+        funasr_models["zh"] = model
+        return model
     except Exception as e:
         logging.error(f"模型初始化失败: {str(e)}")
         raise RuntimeError("模型加载失败，请检查模型配置")
 
 
+def warmup_model(model):
+    """用静音音频跑主模型（跳过VAD，否则静音会被直接丢弃），提前完成CUDA初始化与cuDNN算法选择"""
+    for seconds in WARMUP_SECONDS:
+        silence = np.zeros(16000 * seconds, dtype=np.float32)
+        model.inference(silence, model=model.model)
+
+
 def initialize():
     """应用启动时初始化模型"""
     global initialized
@@ -102,69 +146,221 @@ def validate_path(input_path):
         raise ValueError("禁止相对路径访问")
 
 
-def background_task(task_id, input_path):
-    """后台任务处理"""
+def transcribe_batch(model, batch, names):
+    """批量转写（输入为音频路径或16k数组），整批失败时逐个重试；返回与batch对应的文本列表，失败项为None"""
+    try:
+        results = model.generate(input=batch, batch_size_s=BATCH_SIZE_S)
+        return [result["text"] for result in results]
+    except Exception as e:
+        logging.warning(f"批量处理失败，改为逐个处理: {str(e)}")
+
+    texts = []
+    for audio, name in zip(batch, names):
+        try:
+            result = model.generate(input=audio)
+            texts.append(result[0]["text"])
+        except Exception as e:
+            logging.error(f"处理失败: {name} - {str(e)}")
+            texts.append(None)
+    return texts
+
+
+def asr_worker():
+    """推理线程：独占模型，从队列动态凑批后统一推理，替代逐请求加锁"""
+    model = create_model()
+    # 推理线程全程关闭autograd记录（inference_mode对本线程生效）
+    with torch.inference_mode():
+        # 在实际处理请求的线程上预热
+        try:
+            warmup_model(model)
+            logging.info("模型预热完成")
+        except Exception as e:
+            logging.warning(f"模型预热失败: {str(e)}")
+        while True:
+            items = [asr_queue.get()]
+            deadline = time.monotonic() + MAX_WAIT_MS / 1000
+            while len(items) < BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(asr_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                texts = transcribe_batch(model, [item["input"] for item in items], [item["name"] for item in items])
+                for item, text in zip(items, texts):
+                    item["text"] = text
+            except Exception as e:
+                logging.error(f"推理线程异常: {str(e)}")
+            finally:
+                for item in items:
+                    item["done"].set()
+
+
+def transcribe_files(inputs, names=None):
+    """提交到推理队列（音频路径或16k数组）并等待结果，返回与inputs对应的文本列表，失败项为None"""
+    names = inputs if names is None else names
+    items = [{"input": audio, "name": name, "text": None, "done": threading.Event()}
+             for audio, name in zip(inputs, names)]
+    for item in items:
+        asr_queue.put(item)
+    for item in items:
+        item["done"].wait()
+    return [item["text"] for item in items]
+
+
+# 启动唯一的推理线程
+threading.Thread(target=asr_worker, daemon=True).start()
+
+
+def load_video_audio(video_path, keep_wav=False):
+    """FFmpeg把视频音轨直接解码为16k单声道数组（经管道，不落盘）；keep_wav时另存audio.wav；失败返回None"""
+    cmd = [
+        FFMPEG_BINARY, "-nostdin", "-loglevel", "error",
+        "-i", video_path,
+        "-vn", "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ar", str(AUDIO_SAMPLE_RATE), "-ac", "1",
+        "-"
+    ]
     try:
-        tasks[task_id]["status"] = "processing"
-
-        model = create_model()
-        wav_files = []
-        for root, _, files in os.walk(input_path):
-            wav_files.extend(
-                os.path.join(root, f)
-                for f in files
-                if f.lower().endswith(".wav")
-            )
-
-        if not wav_files:
-            tasks[task_id].update({
+        pcm = subprocess.run(cmd, check=True, timeout=FFMPEG_TIMEOUT,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    except Exception as e:
+        logging.error(f"音频解码失败: {video_path} - {str(e)}")
+        return None
+
+    if keep_wav:
+        with wave.open(os.path.join(os.path.dirname(video_path), "audio.wav"), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(AUDIO_SAMPLE_RATE)
+            f.writeframes(pcm)
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768
+
+
+def convert_and_transcribe(video_paths, keep_wav=False):
+    """视频直接转写：解码到内存后送入推理队列，跳过WAV文件的写入与再读取；返回文本列表，失败项为None"""
+    audios = [load_video_audio(video_path, keep_wav) for video_path in video_paths]
+    decoded = [i for i, audio in enumerate(audios) if audio is not None]
+    texts = [None] * len(video_paths)
+    results = transcribe_files([audios[i] for i in decoded], [video_paths[i] for i in decoded])
+    for i, text in zip(decoded, results):
+        texts[i] = text
+    return texts
+
+
+def write_text(txt_path, text):
+    """以二进制方式直接写入UTF-8文本，跳过文本模式的编码与缓冲层"""
+    data = memoryview(text.encode("utf-8"))
+    fd = os.open(txt_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+
+def collect_wav_jobs(input_path):
+    """扫描WAV文件，返回 (总数, 待处理的 (wav路径, txt路径) 列表)"""
+    # 扫描时一并算好输出路径，并按目录文件名集合过滤已处理文件，不再逐个stat
+    total_files = 0
+    pending_files = []
+    for root, _, files in os.walk(input_path):
+        names = set(files)
+        for f in files:
+            if f.lower().endswith(".wav"):
+                total_files += 1
+                txt_name = f[:-4] + ".txt"
+                if txt_name not in names:
+                    pending_files.append((os.path.join(root, f), os.path.join(root, txt_name)))
+    return total_files, pending_files
+
+
+def collect_video_jobs(input_path):
+    """扫描视频目录（video*文件），返回 (总数, 待处理的 (视频路径, audio.txt路径) 列表)"""
+    total_files = 0
+    pending_files = []
+    for root, _, files in os.walk(input_path):
+        videos = sorted(f for f in files if f.lower().startswith("video") and f.lower().endswith(VIDEO_EXTS))
+        if not videos:
+            continue
+        total_files += 1
+        if "audio.txt" not in files:
+            pending_files.append((os.path.join(root, videos[0]), os.path.join(root, "audio.txt")))
+    return total_files, pending_files
+
+
+def drain_writes(pending_writes, progress):
+    """等待已提交的写文件任务完成并计入进度"""
+    for source_path, future in pending_writes:
+        try:
+            future.result()
+            progress["success"] += 1
+        except Exception as e:
+            logging.error(f"处理失败: {source_path} - {str(e)}")
+            progress["failed"] += 1
+        progress["processed"] += 1
+    pending_writes.clear()
+
+
+def background_task(task_id, input_path, source="wav", keep_wav=False):
+    """后台任务处理（source为video时直接从视频转写，不经过WAV文件）"""
+    task_state = tasks[task_id]
+    from_video = source == "video"
+    try:
+        task_state["status"] = "processing"
+
+        if from_video:
+            total_files, pending_files = collect_video_jobs(input_path)
+        else:
+            total_files, pending_files = collect_wav_jobs(input_path)
+
+        if not total_files:
+            task_state.update({
                 "status": "failed",
-                "details": {"error": "未找到WAV文件"}
+                "details": {"error": "未找到视频文件" if from_video else "未找到WAV文件"}
             })
             return
 
-        # 初始化进度跟踪
-        total_files = len(wav_files)
-        task_progress[task_id] = {
-            "processed": 0,
-            "success": 0,
+        # 初始化进度跟踪（已处理文件直接计为成功）
+        done_files = total_files - len(pending_files)
+        progress = task_progress[task_id] = {
+            "processed": done_files,
+            "success": done_files,
             "failed": 0,
             "total": total_files
         }
 
-        for idx, wav_path in enumerate(wav_files, 1):
-            if tasks[task_id]["status"] == "cancelled":
+        pending_writes = []
+        for i in range(0, len(pending_files), BATCH_SIZE):
+            if task_state["status"] == "cancelled":
                 break
 
-            txt_path = os.path.splitext(wav_path)[0] + ".txt"
-            if os.path.exists(txt_path):
-                task_progress[task_id]["success"] += 1
-                task_progress[task_id]["processed"] = idx
-                continue
-
-            try:
-                with MODEL_LOCK:
-                    result = model.generate(input=wav_path)
-                    text = result[0]["text"]
-
-                with open(txt_path, "w", encoding="utf-8") as f:
-                    f.write(text)
-                task_progress[task_id]["success"] += 1
-            except Exception as e:
-                logging.error(f"处理失败: {wav_path} - {str(e)}")
-                task_progress[task_id]["failed"] += 1
-
-            task_progress[task_id]["processed"] = idx
-
-        tasks[task_id].update({
+            batch = pending_files[i:i + BATCH_SIZE]
+            sources = [source_path for source_path, _ in batch]
+            texts = convert_and_transcribe(sources, keep_wav) if from_video else transcribe_files(sources)
+            # 先确认上一批的写入结果，再异步提交本批写入，使写文件与下一批推理重叠
+            drain_writes(pending_writes, progress)
+            for (source_path, txt_path), text in zip(batch, texts):
+                if text is None:
+                    progress["failed"] += 1
+                    progress["processed"] += 1
+                    continue
+                pending_writes.append((source_path, write_executor.submit(write_text, txt_path, text)))
+
+        drain_writes(pending_writes, progress)
+
+        task_state.update({
             "status": "completed",
-            "success_count": task_progress[task_id]["success"],
-            "failed_count": task_progress[task_id]["failed"]
+            "success_count": progress["success"],
+            "failed_count": progress["failed"]
         })
 
     except Exception as e:
         logging.error(f"任务失败: {task_id} - {str(e)}")
-        tasks[task_id].update({
+        task_state.update({
             "status": "failed",
             "details": {"error": str(e)}
         })
@@ -178,24 +374,26 @@ def create_task():
     data = request.get_json()
     input_path = data.get('input_path')
     priority = data.get('priority', 0)
+    source = data.get('source', 'wav')  # wav：转写已有WAV；video：直接从视频转写
+    keep_wav = bool(data.get('keep_wav', False))
 
     try:
         validate_path(input_path)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    if source not in ("wav", "video"):
+        return jsonify({"error": "source 仅支持 wav 或 video"}), 400
 
     task_id = str(uuid.uuid4())
     tasks[task_id] = {
         "input_path": os.path.abspath(input_path),
         "status": "queued",
-        "priority": priority
+        "priority": priority,
+        "source": source
     }
 
-    # 启动后台线程
-    threading.Thread(
-        target=background_task,
-        args=(task_id, input_path)
-    ).start()
+    # 提交到任务线程池
+    tasks[task_id]["future"] = task_executor.submit(background_task, task_id, input_path, source, keep_wav)
 
     return jsonify({
         "task_id": task_id,
@@ -229,6 +427,10 @@ def cancel_task(task_id):
     if tasks[task_id]["status"] in ("completed", "failed"):
         return jsonify({"error": "任务无法取消"}), 400
 
+    # 尚在排队的任务直接撤销；已在执行的任务由 background_task 在批次间检查状态后退出
+    future = tasks[task_id].get("future")
+    if future is not None:
+        future.cancel()
     tasks[task_id]["status"] = "cancelled"
     return jsonify({"message": "取消请求已接受"})
 
@@ -2,16 +2,21 @@
 import os
 import argparse
 import traceback
+from functools import lru_cache
 import torch
 from tqdm import tqdm
 from funasr import AutoModel
+from asr_utils import ASR_PRECISION, compile_encoder
+from walk_utils import parallel_walk
 
-# 全局模型缓存
-funasr_models = {}
+# 批量推理参数
+BATCH_SIZE = 8  # 每次 generate 的文件数
+BATCH_SIZE_S = 300  # VAD 分段批处理的总时长（秒）
 
 
+@lru_cache(maxsize=1)
 def create_model():
-    """创建中文语音识别模型（固定配置）"""
+    """创建中文语音识别模型（固定配置，进程内单例）"""
     model_paths = {
         "asr": 'tools/asr/models/speech_paraformer-large_asr_nat-zh-cn-16k-common-vocab8404-pytorch',
         "vad": 'tools/asr/models/speech_fsmn_vad_zh-cn-16k-common-pytorch',
@@ -25,43 +30,47 @@ def create_model():
     path_punc = model_paths["punc"] if os.path.exists(
         model_paths["punc"]) else "iic/punc_ct-transformer_zh-cn-common-vocab272727-pytorch"
 
-    if "zh" not in funasr_models:
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        model = AutoModel(
-            model=path_asr,
-            vad_model=path_vad,
-            punc_model=path_punc,
-            model_revision="v2.0.4",
-            vad_model_revision="v2.0.4",
-            punc_model_revision="v2.0.4",
-            device=device,
-            vad_kwargs={"max_single_segment_time": 60000}
-        )
-        funasr_models["zh"] = model
-    return funasr_models["zh"]
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    model = AutoModel(
+        model=path_asr,
+        vad_model=path_vad,
+        punc_model=path_punc,
+        model_revision="v2.0.4",
+        vad_model_revision="v2.0.4",
+        punc_model_revision="v2.0.4",
+        device=device,
+        fp16=device.startswith("cuda") and ASR_PRECISION == "fp16",  # GPU上以FP16运行paraformer主模型
+        vad_kwargs={"max_single_segment_time": 60000}
+    )
+    compile_encoder(model, device)
+    return model
+
+
+def get_txt_path(mp3_path):
+    """音频对应的文本输出路径"""
+    return os.path.splitext(mp3_path)[0] + ".txt"
+
+
+def is_processed(mp3_path):
+    """检查音频是否已转写（同名txt或同目录audio.txt任一存在）"""
+    audio_txt_path = os.path.join(os.path.dirname(mp3_path), "audio.txt")
+    return os.path.exists(get_txt_path(mp3_path)) or os.path.exists(audio_txt_path)
 
 
 def process_audio(mp3_path):
     """处理单个音频文件"""
     try:
-        dir_path = os.path.dirname(mp3_path)
-        file_name = os.path.basename(mp3_path)
-        base_name = os.path.splitext(file_name)[0]
-        txt_path = os.path.join(dir_path, f"{base_name}.txt")
-
-        # 新增：检查同目录下是否存在 audio.txt
-        audio_txt_path = os.path.join(dir_path, "audio.txt")
-
         # 任一文件存在则跳过
-        if os.path.exists(txt_path) or os.path.exists(audio_txt_path):
-            print(audio_txt_path)
+        if is_processed(mp3_path):
+            print(mp3_path)
             print("已处理, 有文件")
             return True
 
         model = create_model()
-        result = model.generate(input=mp3_path)
+        with torch.inference_mode():
+            result = model.generate(input=mp3_path)
 
-        with open(txt_path, "w", encoding="utf-8") as f:
+        with open(get_txt_path(mp3_path), "w", encoding="utf-8") as f:
             f.write(result[0]["text"])
 
         return True
@@ -70,35 +79,72 @@ def process_audio(mp3_path):
         return False
 
 
+def process_batch(batch):
+    """批量处理 (mp3_path, txt_path) 列表，返回成功数量"""
+    try:
+        model = create_model()
+        with torch.inference_mode():
+            results = model.generate(input=[mp3_path for mp3_path, _ in batch], batch_size_s=BATCH_SIZE_S)
+
+        for (mp3_path, txt_path), result in zip(batch, results):
+            with open(txt_path, "w", encoding="utf-8") as f:
+                f.write(result["text"])
+
+        return len(batch)
+    except Exception as e:
+        # 整批失败时逐个重试，避免单个损坏文件拖累整批
+        print(f"\n批量处理失败，改为逐个处理\n{str(e)}")
+        return sum(1 for mp3_path, _ in batch if process_audio(mp3_path))
+
+
 def process_folder(folder_path):
     """递归处理文件夹"""
-    mp3_files = []
+    total_files = 0  # 只需计数，不保存全部路径
+    pending_files = []
 
-    # 递归扫描目录
-    for root, _, files in os.walk(folder_path):
+    # 递归扫描目录：每个目录只用一次扫描结果完成全部跳过判断，不再逐个stat
+    for root, dirs, files in parallel_walk(folder_path):
+        names = set(files)
         # 先检查当前目录是否存在 audio.txt
-        if os.path.exists(os.path.join(root, "audio.txt")):
+        if "audio.txt" in names:
             print(root + 'find audio.txt')
-            continue  # 跳过包含 audio.txt 的整个目录
+            dirs[:] = []  # 跳过包含 audio.txt 的整个目录（含子目录）
+            continue
 
         for file in files:
             if file.lower().endswith(".mp3"):
-                mp3_files.append(os.path.join(root, file))
-
-    if not mp3_files:
+                mp3_path = os.path.join(root, file)
+                total_files += 1
+                # 批量推理前先过滤已有同名txt的文件，避免浪费GPU
+                # 扫描时一并算好输出路径（已知后缀为4个字符），后续不再拆分路径
+                txt_name = file[:-4] + ".txt"
+                if txt_name not in names:
+                    pending_files.append((mp3_path, os.path.join(root, txt_name)))
+
+    if not total_files:
         print("错误：未找到mp3文件")
         return False
+
+    # 全部已处理时直接返回，不加载模型
+    if not pending_files:
+        print(f"全部{total_files}个文件已处理，无需加载模型")
+        return True
+
+    skipped_count = total_files - len(pending_files)
     print('start')
     # 创建进度条
-    with tqdm(total=len(mp3_files), desc="处理进度", unit="file") as pbar:
-        success_count = 0
-        for mp3_path in mp3_files:
-            if process_audio(mp3_path):
-                success_count += 1
-            pbar.update(1)
-            pbar.set_postfix({"成功率": f"{success_count / len(mp3_files):.1%}"})
-
-    print(f"\n处理完成: 成功{success_count}个, 失败{len(mp3_files) - success_count}个")
+    # mininterval 让tqdm自身把重绘限制在每秒2次
+    with tqdm(total=total_files, desc="处理进度", unit="file", mininterval=0.5) as pbar:
+        success_count = skipped_count
+        pbar.update(skipped_count)
+        for i in range(0, len(pending_files), BATCH_SIZE):
+            batch = pending_files[i:i + BATCH_SIZE]
+            success_count += process_batch(batch)
+            pbar.update(len(batch))
+            # 不强制刷新，由tqdm按最小间隔统一重绘，避免每批都写终端
+            pbar.set_postfix({"成功率": f"{success_count / total_files:.1%}"}, refresh=False)
+
+    print(f"\n处理完成: 成功{success_count}个, 失败{total_files - success_count}个")
     return True
 
 
@@ -119,6 +165,4 @@ if __name__ == "__main__":
     if not os.path.isdir(root_folder):
         print(f"错误：路径不存在或不是文件夹 - {root_folder}")
         exit(1)
-    create_model()  # 预加载模型
-    print("create_model")
     process_folder(root_folder)
\ No newline at end of file
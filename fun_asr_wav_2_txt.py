@@ -2,16 +2,21 @@
 import os
 import argparse
 import traceback
+from functools import lru_cache
 import torch
 from tqdm import tqdm
 from funasr import AutoModel
+from asr_utils import ASR_PRECISION, compile_encoder
+from walk_utils import parallel_walk
 
-# 全局模型缓存
-funasr_models = {}
+# 批量推理参数
+BATCH_SIZE = 16  # 每次 generate 的文件数
+BATCH_SIZE_S = 300  # VAD 分段批处理的总时长（秒）
 
 
+@lru_cache(maxsize=1)
 def create_model():
-    """创建中文语音识别模型（固定配置）"""
+    """创建中文语音识别模型（固定配置，进程内单例）"""
     model_paths = {
         "asr": 'tools/asr/models/speech_paraformer-large_asr_nat-zh-cn-16k-common-vocab8404-pytorch',
         "vad": 'tools/asr/models/speech_fsmn_vad_zh-cn-16k-common-pytorch',
@@ -25,32 +30,34 @@ def create_model():
     path_punc = model_paths["punc"] if os.path.exists(
         model_paths["punc"]) else "iic/punc_ct-transformer_zh-cn-common-vocab272727-pytorch"
 
-    if "zh" not in funasr_models:
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        model = AutoModel(
-            model=path_asr,
-            vad_model=path_vad,
-            punc_model=path_punc,
-            model_revision="v2.0.4",
-            vad_model_revision="v2.0.4",
-            punc_model_revision="v2.0.4",
-            device=device,
-            vad_kwargs={"max_single_segment_time": 60000}
-        )
-        funasr_models["zh"] = model
-    return funasr_models["zh"]
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    model = AutoModel(
+        model=path_asr,
+        vad_model=path_vad,
+        punc_model=path_punc,
+        model_revision="v2.0.4",
+        vad_model_revision="v2.0.4",
+        punc_model_revision="v2.0.4",
+        device=device,
+        fp16=device.startswith("cuda") and ASR_PRECISION == "fp16",  # GPU上以FP16运行paraformer主模型
+        vad_kwargs={"max_single_segment_time": 60000}
+    )
+    compile_encoder(model, device)
+    return model
+
+
+def get_txt_path(wav_path):
+    """音频对应的文本输出路径"""
+    return os.path.splitext(wav_path)[0] + ".txt"
 
 
 def process_audio(wav_path):
     """处理单个音频文件"""
     try:
-        dir_path = os.path.dirname(wav_path)
-        file_name = os.path.basename(wav_path)
-        base_name = os.path.splitext(file_name)[0]
-        txt_path = os.path.join(dir_path, f"{base_name}.txt")
+        txt_path = get_txt_path(wav_path)
 
         # 新增：检查同目录下是否存在 audio.txt
-        audio_txt_path = os.path.join(dir_path, "audio.txt")
+        audio_txt_path = os.path.join(os.path.dirname(wav_path), "audio.txt")
 
         # 任一文件存在则跳过
         if os.path.exists(txt_path) or os.path.exists(audio_txt_path):
@@ -59,7 +66,8 @@ def process_audio(wav_path):
             return True
 
         model = create_model()
-        result = model.generate(input=wav_path)
+        with torch.inference_mode():
+            result = model.generate(input=wav_path)
 
         with open(txt_path, "w", encoding="utf-8") as f:
             f.write(result[0]["text"])
@@ -70,35 +78,69 @@ def process_audio(wav_path):
         return False
 
 
+def process_batch(batch):
+    """批量处理 (wav_path, txt_path) 列表，返回成功数量"""
+    try:
+        model = create_model()
+        with torch.inference_mode():
+            results = model.generate(input=[wav_path for wav_path, _ in batch], batch_size_s=BATCH_SIZE_S)
+
+        for (wav_path, txt_path), result in zip(batch, results):
+            with open(txt_path, "w", encoding="utf-8") as f:
+                f.write(result["text"])
+
+        return len(batch)
+    except Exception as e:
+        # 整批失败时逐个重试，避免单个损坏文件拖累整批
+        print(f"\n批量处理失败，改为逐个处理\n{str(e)}")
+        return sum(1 for wav_path, _ in batch if process_audio(wav_path))
+
+
 def process_folder(folder_path):
     """递归处理文件夹"""
-    wav_files = []
+    total_files = 0  # 只需计数，不保存全部路径
+    pending_files = []
 
     # 递归扫描目录
-    for root, _, files in os.walk(folder_path):
+    for root, _, files in parallel_walk(folder_path):
+        names = set(files)
         # 先检查当前目录是否存在 audio.txt
-        if os.path.exists(os.path.join(root, "audio.txt")):
+        if "audio.txt" in names:
             print('find audio.txt')
             continue  # 跳过包含 audio.txt 的整个目录
 
         for file in files:
             if file.lower().endswith(".wav"):
-                wav_files.append(os.path.join(root, file))
-
-    if not wav_files:
+                wav_path = os.path.join(root, file)
+                total_files += 1
+                # 扫描时一并算好输出路径（已知后缀为4个字符），后续不再拆分路径
+                txt_name = file[:-4] + ".txt"
+                if txt_name not in names:
+                    pending_files.append((wav_path, os.path.join(root, txt_name)))
+
+    if not total_files:
         print("错误：未找到WAV文件")
         return False
+
+    # 全部已处理时直接返回，不加载模型
+    if not pending_files:
+        print(f"全部{total_files}个文件已处理，无需加载模型")
+        return True
+
     print('start')
     # 创建进度条
-    with tqdm(total=len(wav_files), desc="处理进度", unit="file") as pbar:
-        success_count = 0
-        for wav_path in wav_files:
-            if process_audio(wav_path):
-                success_count += 1
-            pbar.update(1)
-            pbar.set_postfix({"成功率": f"{success_count / len(wav_files):.1%}"})
-
-    print(f"\n处理完成: 成功{success_count}个, 失败{len(wav_files) - success_count}个")
+    # mininterval 让tqdm自身把重绘限制在每秒2次
+    with tqdm(total=total_files, desc="处理进度", unit="file", mininterval=0.5) as pbar:
+        success_count = total_files - len(pending_files)
+        pbar.update(success_count)
+        for i in range(0, len(pending_files), BATCH_SIZE):
+            batch = pending_files[i:i + BATCH_SIZE]
+            success_count += process_batch(batch)
+            pbar.update(len(batch))
+            # 不强制刷新，由tqdm按最小间隔统一重绘，避免每批都写终端
+            pbar.set_postfix({"成功率": f"{success_count / total_files:.1%}"}, refresh=False)
+
+    print(f"\n处理完成: 成功{success_count}个, 失败{total_files - success_count}个")
     return True
 
 
@@ -119,6 +161,4 @@ if __name__ == "__main__":
     if not os.path.isdir(root_folder):
         print(f"错误：路径不存在或不是文件夹 - {root_folder}")
         exit(1)
-    create_model()  # 预加载模型
-    print("create_model")
     process_folder(root_folder)
\ No newline at end of file
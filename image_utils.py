@@ -0,0 +1,97 @@
+"""
+image_utils.py
+图片处理工具（各 txt2pdf 脚本共用）：
+- 记录Pillow版本与JPEG后端
+- 进程内复用的图片压缩线程池
+- 图片压缩（小JPEG直接嵌入，其余缩小后转为内存中的JPEG）
+"""
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import PIL
+from PIL import Image, features
+
+# NumPy 可一次完成透明图与白底的合成；未安装时退回 PIL 的 paste
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+IMAGE_THREADS = 4  # 图片压缩线程数（Pillow缩放与JPEG编码会释放GIL）
+IMAGE_DPI = 200  # 图片嵌入分辨率：超过单元格在此DPI下像素尺寸的图片会被缩小
+PASSTHROUGH_SLACK = 1.2  # JPEG原图不超过单元格像素尺寸的此倍数时直接嵌入
+PASSTHROUGH_FORMATS = ('JPEG',)  # 按文件内容（而非扩展名）判断可直接嵌入的格式
+PASSTHROUGH_MODES = ('RGB', 'L')
+
+
+def log_image_backend():
+    """记录Pillow版本与JPEG后端，便于发现图片处理性能退化"""
+    turbo = features.check_feature("libjpeg_turbo")
+    logging.info(f"Pillow {PIL.__version__}，libjpeg-turbo：{'是' if turbo else '否'}")
+    if not turbo:
+        # Pillow-SIMD（非Windows）/ libjpeg-turbo 可显著加快缩放与JPEG编码
+        logging.warning("当前Pillow未使用libjpeg-turbo，图片压缩会较慢")
+
+
+@lru_cache(maxsize=1)
+def get_image_executor():
+    """进程内复用的图片压缩线程池"""
+    return ThreadPoolExecutor(max_workers=IMAGE_THREADS)
+
+
+def flatten_alpha(img):
+    """将RGBA图片合成到白色背景上，返回RGB图片"""
+    if np is None:
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[3])
+        return background
+    # 整数运算一次完成：rgb*a + 255*(255-a)，四舍五入后除以255
+    arr = np.asarray(img)
+    alpha = arr[..., 3:4].astype(np.uint16)
+    rgb = arr[..., :3] * alpha
+    rgb += 255 * (255 - alpha)
+    rgb += 127
+    rgb //= 255
+    return Image.fromarray(rgb.astype(np.uint8), 'RGB')
+
+
+def compress_image(img_path, compress_ratio, jpeg_quality, subsampling, optimize, max_size):
+    """压缩单张图片为内存中的JPEG（在线程池中执行，不访问PDF对象），返回待嵌入的图片（路径或BytesIO）"""
+    with Image.open(img_path) as img:
+        # 已足够小的JPEG直接嵌入：fpdf2 不重新编码JPEG，省去解码与再压缩
+        if (img.format in PASSTHROUGH_FORMATS and img.mode in PASSTHROUGH_MODES
+                and img.width <= max_size[0] * PASSTHROUGH_SLACK
+                and img.height <= max_size[1] * PASSTHROUGH_SLACK):
+            return img_path
+
+        # 只缩小超出单元格的图片：目标不超过单元格像素尺寸，且至少按 compress_ratio 缩小
+        needs_resize = img.width > max_size[0] or img.height > max_size[1]
+        if needs_resize:
+            new_size = (
+                min(int(max_size[0]), int(img.width * compress_ratio)),
+                min(int(max_size[1]), int(img.height * compress_ratio))
+            )
+            # JPEG 直接以1/2、1/4、1/8比例缩小解码（结果不小于目标尺寸时才生效，其他格式忽略）
+            img.draft(None, new_size)
+
+        # 优化压缩逻辑：thumbnail 先整数倍快速缩小再精细重采样，保持宽高比
+        if needs_resize:
+            img.thumbnail(new_size, Image.Resampling.LANCZOS)
+
+        # 保留透明度通道（缩小后再合成，处理的像素更少）
+        if img.mode == 'RGBA':
+            img = flatten_alpha(img)
+
+        # 高质量保存（写入内存，不经临时文件）
+        buffer = io.BytesIO()
+        img.save(
+            buffer,
+            format='JPEG',
+            quality=jpeg_quality,
+            optimize=optimize,
+            subsampling=subsampling
+        )
+    buffer.seek(0)
+    return buffer
@@ -1,15 +1,14 @@
 import os
 import shutil
 import sys
+from walk_utils import parallel_walk
 
 
 def move_video_files(source_dir, target_base_dir):
-    for dirpath, _, filenames in os.walk(source_dir):
-        video_path = os.path.join(dirpath, 'video.mp4')
-        audio_path = os.path.join(dirpath, 'audio.wav')
-
-        # 检查两个文件是否同时存在
-        if os.path.isfile(video_path) and os.path.isfile(audio_path):
+    for dirpath, _, filenames in parallel_walk(source_dir):
+        # 直接用遍历得到的文件名判断，无需再逐个stat
+        if 'video.mp4' in filenames and 'audio.wav' in filenames:
+            video_path = os.path.join(dirpath, 'video.mp4')
             # 计算相对路径
             relative_path = os.path.relpath(dirpath, source_dir)
             # 构建目标目录路径
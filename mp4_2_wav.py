@@ -11,14 +11,15 @@ import logging
 import os
 import re
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from moviepy import VideoFileClip, config
+from ffmpeg_utils import CONVERT_WORKERS, convert_group, find_conversion, split_groups
+from walk_utils import parallel_walk
 
 # 配置参数
-VIDEO_NAME = "video"  # 主视频文件名（不含扩展）
-AUDIO_NAME = "audio.wav"
 LOG_FILE = "conversion.log"
-VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
+PROGRESS_EVERY = 64  # 每完成多少个文件汇报一次进度
 
 
 def setup_logging():
@@ -51,29 +52,6 @@ def check_ffmpeg():
         return False
 
 
-def convert_video_to_audio(video_path, audio_path):
-    """核心转换逻辑"""
-    try:
-        with VideoFileClip(video_path) as video:
-            audio = video.audio
-            audio.write_audiofile(
-                audio_path,
-                codec='pcm_s16le',
-                fps=44100,
-                logger=None  # 禁用详细日志
-            )
-            return True
-    except Exception as e:
-        logging.error(f"转换失败：{video_path} - {str(e)}")
-        # os.remove(video_path)
-        # print(f"已删除： {video_path}")
-        ## 不修了，直接删
-        # if "failed to read the first frame" in str(e):
-        #     ####
-        #     return repair_video(video_path, audio_path)
-        return False
-
-
 def repair_video(input_path, output_path):
     """视频修复预处理"""
     try:
@@ -101,32 +79,6 @@ def repair_video(input_path, output_path):
         return False
 
 
-def process_directory(folder_path):
-    """处理单个目录"""
-    # 检查目标音频文件存在性
-    target_audio = os.path.join(folder_path, AUDIO_NAME)
-    if os.path.isfile(target_audio):  # 精确判断文件存在性[2,6](@ref)
-        logging.info(f"跳过目录：{folder_path}（{AUDIO_NAME}已存在）")
-        print(f"[跳过] {folder_path} 已存在音频文件")
-        return False
-
-    # 查找视频文件
-    video_files = [
-        f for f in os.listdir(folder_path)
-        if f.lower().startswith(VIDEO_NAME.lower())
-           and f.lower().endswith(VIDEO_EXTS)
-    ]
-
-    if not video_files:
-        return False
-
-    # 处理第一个符合条件的视频文件
-    source_video = os.path.join(folder_path, video_files[0])
-
-    logging.info(f"开始转换：{source_video}")
-    return convert_video_to_audio(source_video, target_audio)
-
-
 def main():
     setup_logging()
 
@@ -144,10 +96,17 @@ def main():
     # root_folder = '/Volumes/PenghaoMac2/XHS data'
     root_folder = 'G:\\XHS data'
     root_folder = 'D:\\Users\\penghao\\Downloads'
-    processed = 0
-    for root, dirs, files in os.walk(root_folder):
-        if process_directory(root):
-            processed += 1
+    # 先收集全部任务，再分组并发调用FFmpeg（每组一个ffmpeg进程）
+    tasks = [task for task in (find_conversion(root) for root, _, _ in parallel_walk(root_folder)) if task]
+    groups = split_groups(tasks)
+    processed = done = 0
+    with ThreadPoolExecutor(max_workers=CONVERT_WORKERS) as pool:
+        for group, ok in zip(groups, pool.map(convert_group, groups)):
+            processed += ok
+            # 按固定间隔汇报进度，不再逐文件打印
+            if (done + len(group)) // PROGRESS_EVERY > done // PROGRESS_EVERY or group is groups[-1]:
+                logging.info(f"转换进度：{done + len(group)}/{len(tasks)}，成功 {processed}")
+            done += len(group)
 
     logging.info(f"处理完成！共转换 {processed} 个音频文件")
     print(f"\n{'-' * 40}")
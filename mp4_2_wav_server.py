@@ -12,15 +12,21 @@ import logging
 import os
 import subprocess
 from flask import Flask, request, jsonify
-import threading
-from moviepy import VideoFileClip, config
+from concurrent.futures import ThreadPoolExecutor
+from moviepy import config
+from ffmpeg_utils import CONVERT_WORKERS, convert_group, find_conversion, split_groups
+from walk_utils import parallel_walk
 
 app = Flask(__name__)
 
 # 配置参数
-AUDIO_NAME = "audio.wav"
 LOG_FILE = "conversion_service.log"
-VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
+MAX_CONCURRENT_TASKS = 3  # 同时处理的目录树请求数
+PROGRESS_EVERY = 64  # 每完成多少个文件汇报一次进度
+
+# 目录树任务池与FFmpeg转换池分开，避免任务等待自身子任务导致死锁
+TASK_POOL = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TASKS)
+CONVERT_POOL = ThreadPoolExecutor(max_workers=CONVERT_WORKERS)
 
 
 def setup_logging():
@@ -53,54 +59,19 @@ def check_ffmpeg():
         return False
 
 
-def convert_video_to_audio(video_path, audio_path):
-    """核心转换逻辑"""
-    try:
-        with VideoFileClip(video_path) as video:
-            audio = video.audio
-            audio.write_audiofile(
-                audio_path,
-                codec='pcm_s16le',
-                fps=44100,
-                logger=None
-            )
-            return True
-    except Exception as e:
-        logging.error(f"转换失败：{video_path} - {str(e)}")
-        if os.path.exists(video_path):
-            # os.remove(video_path)
-            logging.info(f"已删除损坏文件：{video_path}")
-        return False
-
-
-def process_directory(folder_path):
-    """处理单个目录"""
-    target_audio = os.path.join(folder_path, AUDIO_NAME)
-    if os.path.isfile(target_audio):
-        logging.info(f"跳过目录：{folder_path}（{AUDIO_NAME}已存在）")
-        return False
-
-    video_files = [
-        f for f in os.listdir(folder_path)
-        if f.lower().startswith('video')
-           and f.lower().endswith(VIDEO_EXTS)
-    ]
-
-    if not video_files:
-        return False
-
-    source_video = os.path.join(folder_path, video_files[0])
-    logging.info(f"开始转换：{source_video}")
-    return convert_video_to_audio(source_video, target_audio)
-
-
 def process_root_folder(root_folder):
-    """处理整个目录树"""
+    """处理整个目录树：先收集任务，再交给共享转换池并发执行"""
     processed = 0
     try:
-        for root, dirs, files in os.walk(root_folder):
-            if process_directory(root):
-                processed += 1
+        tasks = [task for task in (find_conversion(root) for root, _, _ in parallel_walk(root_folder)) if task]
+        groups = split_groups(tasks)
+        done = 0
+        for group, ok in zip(groups, CONVERT_POOL.map(convert_group, groups)):
+            processed += ok
+            # 按固定间隔汇报进度，不再逐文件打印
+            if (done + len(group)) // PROGRESS_EVERY > done // PROGRESS_EVERY:
+                logging.info(f"转换进度：{root_folder} {done + len(group)}/{len(tasks)}，成功 {processed}")
+            done += len(group)
         logging.info(f"处理完成：{root_folder} 转换 {processed} 个音频文件")
     except Exception as e:
         logging.error(f"目录处理异常：{root_folder} - {str(e)}")
@@ -121,12 +92,8 @@ def handle_convert():
         return jsonify({"error": "Path is not a directory"}), 400
 
     try:
-        # 启动异步处理线程
-        thread = threading.Thread(
-            target=process_root_folder,
-            args=(os.path.abspath(folder_path),)
-        )
-        thread.start()
+        # 提交到任务池异步处理（并发目录数有上限）
+        TASK_POOL.submit(process_root_folder, os.path.abspath(folder_path))
         return jsonify({
             "status": "processing",
             "path": folder_path,
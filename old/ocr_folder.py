@@ -1,4 +1,6 @@
 import os, sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import pytesseract
 from PIL import Image
 import pytesseract
@@ -6,12 +8,41 @@ import pytesseract
 import os
 import pytesseract
 
+# tesserocr 在进程内调用 Tesseract API，只初始化一次；未安装时退回 pytesseract（每张图启动一个tesseract进程）
+try:
+    from tesserocr import PyTessBaseAPI
+except ImportError:
+    PyTessBaseAPI = None
+
 # 强制指定路径配置
+TESSDATA_DIR = '/opt/homebrew/share/tessdata/'
 pytesseract.pytesseract.tesseract_cmd = '/opt/homebrew/bin/tesseract'
-os.environ['TESSDATA_PREFIX'] = '/opt/homebrew/share/tessdata/'  # 精确到tessdata目录
+os.environ['TESSDATA_PREFIX'] = TESSDATA_DIR  # 精确到tessdata目录
+
+OCR_WORKERS = os.cpu_count() or 1  # Tesseract识别时释放GIL，线程数按核数设置
+
+# 每个线程各自持有一个 Tesseract API 实例（实例本身不可跨线程共享）
+_tess_local = threading.local()
+
+# 进程级线程池：线程跨文件夹复用，各线程的 API 实例也随之复用
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS)
+
+
+def get_tess_api():
+    """懒加载并复用当前线程的 Tesseract API 实例"""
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = _tess_local.api = PyTessBaseAPI(lang='chi_sim', path=TESSDATA_DIR)
+    return api
+
 
 def ocr_image(image_path):
     try:
+        if PyTessBaseAPI is not None:
+            api = get_tess_api()
+            api.SetImageFile(image_path)
+            return api.GetUTF8Text().strip()
+
         img = Image.open(image_path)
         # 使用如下任一配置方式
         # text = pytesseract.image_to_string(img, lang='chi_sim')  # 方式一：依赖环境变量
@@ -26,10 +57,15 @@ def ocr_image(image_path):
 def get_image_files(folder_path):
     """获取文件夹及其子文件夹中的所有图片文件"""
     image_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif']
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if os.path.splitext(file)[1].lower() in image_extensions:
-                yield os.path.join(root, file)
+    # scandir 复用目录项缓存的类型信息，避免 os.walk + join 的额外stat
+    stack = [folder_path]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in image_extensions:
+                    yield entry.path
 
 
 def process_folder(folder_path):
@@ -37,9 +73,15 @@ def process_folder(folder_path):
     txt_path = os.path.join(folder_path, "pic_content.txt")
     content = []
 
-    for img_path in get_image_files(folder_path):
-        print(f"正在识别：{img_path}")
-        text = ocr_image(img_path)
+    image_paths = list(get_image_files(folder_path))
+    if not image_paths:
+        return
+    print(f"正在识别：{len(image_paths)} 张图片")
+
+    # 多线程并发识别，map 保持原有图片顺序
+    texts = list(ocr_executor.map(ocr_image, image_paths))
+
+    for img_path, text in zip(image_paths, texts):
         if text:
             content.append(f"文件：{os.path.basename(img_path)}")
             content.append(text)
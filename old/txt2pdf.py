@@ -1,46 +1,103 @@
+import codecs
 import os
 import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import islice
 from fpdf import FPDF
 
+# old/ 下的脚本单独运行，需把上级目录加入搜索路径以复用公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from walk_utils import within_dirs  # noqa: E402
+
+# cchardet 可从文件头一次判断编码；未安装时退回逐个编码试解码
+try:
+    import cchardet
+except ImportError:
+    cchardet = None
+
 # 字体处理部分保持不变
 USER_FONT_DIR = os.path.expanduser("~/fpdf_fonts")
 os.makedirs(USER_FONT_DIR, exist_ok=True)
 FPDF_FONT_DIR = USER_FONT_DIR
 
+# 预编译正则（文件名清洗）
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
+WHITESPACE_RE = re.compile(r'\s+')
+
+# 候选字体按优先级排列；存在性只在导入时检测一次，不再每个文件重复stat
+SYSTEM_FONT_DIR = os.path.expanduser("~/Library/Fonts/")
+SUPPORTED_FONTS = [
+    ("PingFang", f"{SYSTEM_FONT_DIR}PingFang.ttc"),
+    ("ArialUnicode", f"{SYSTEM_FONT_DIR}Arial Unicode.ttf"),
+    ("STHeiti", f"{SYSTEM_FONT_DIR}华文黑体.ttf")
+]
+AVAILABLE_FONTS = [(name, path) for name, path in SUPPORTED_FONTS if os.path.exists(path)]
+
+ENCODINGS = ['utf-8', 'gb18030', 'big5', 'latin-1']  # 按顺序尝试的文本编码
+READ_CHUNK_SIZE = 1 << 20  # 编码检测时每次读取的字节数
+DETECT_HEAD_SIZE = 64 * 1024  # BOM/cchardet 检测读取的文件头字节数
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+# cchardet 的检测结果映射到兼容的超集编码
+CHARDET_ALIASES = {'ascii': 'utf-8', 'gb2312': 'gb18030', 'gbk': 'gb18030'}
+LINES_PER_BLOCK = 200  # 每次 multi_cell 排版的行数，内存只与块大小相关
+
 
 def sanitize_filename(name):
     """生成安全文件名，处理特殊字符和长度"""
     # 替换非法字符
-    clean_name = re.sub(r'[\\/*?:"<>|]', "-", name)
+    clean_name = name.translate(INVALID_FILENAME_TABLE)
     # 替换连续空格为单个下划线
-    clean_name = re.sub(r'\s+', '_', clean_name)
+    clean_name = WHITESPACE_RE.sub('_', clean_name)
     # 保留前40个字符
     return clean_name[:40]
 
 
+def detect_encoding(txt_path):
+    """检测文件编码：先看BOM，再用cchardet判断文件头，否则逐块试解码（不在内存中保留全文）"""
+    with open(txt_path, "rb") as f:
+        head = f.read(DETECT_HEAD_SIZE)
+    for bom, encoding in BOM_ENCODINGS:
+        if head.startswith(bom):
+            return encoding
+    if cchardet is not None:
+        encoding = (cchardet.detect(head)['encoding'] or 'gb18030').lower()
+        return CHARDET_ALIASES.get(encoding, encoding)
+
+    for encoding in ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            with open(txt_path, "rb") as f:
+                for chunk in iter(partial(f.read, READ_CHUNK_SIZE), b""):
+                    decoder.decode(chunk)
+            decoder.decode(b"", final=True)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return 'utf-8'
+
+
 def convert_txt_to_pdf(txt_path, pdf_path):
     """文本转PDF核心函数（保持原功能）"""
     pdf = FPDF()
     pdf.add_page()
     pdf.set_auto_page_break(auto=True, margin=15)
 
-    # 字体选择逻辑保持不变
-    font_path = os.path.expanduser("~/Library/Fonts/")
-    supported_fonts = [
-        ("PingFang", f"{font_path}PingFang.ttc"),
-        ("ArialUnicode", f"{font_path}Arial Unicode.ttf"),
-        ("STHeiti", f"{font_path}华文黑体.ttf")
-    ]
-
+    # 字体选择：按优先级使用第一个可加载的字体
+    # fpdf2 输出时会原地子集化字体对象，解析后的字体不能跨文档复用，故每个文档仍需 add_font
     selected_font = None
-    for name, path in supported_fonts:
-        if os.path.exists(path):
-            try:
-                pdf.add_font(name, "", path, uni=True)
-                selected_font = name
-                break
-            except:
-                continue
+    for name, path in AVAILABLE_FONTS:
+        try:
+            pdf.add_font(name, "", path, uni=True)
+            selected_font = name
+            break
+        except:
+            continue
 
     if not selected_font:
         pdf.add_font("Arial", "", "arial", uni=True)
@@ -48,42 +105,41 @@ def convert_txt_to_pdf(txt_path, pdf_path):
 
     pdf.set_font(selected_font, size=12)
 
-    # 编码检测逻辑
-    encodings = ['utf-8', 'gb18030', 'big5', 'latin-1']
-    with open(txt_path, "rb") as f:
-        content = f.read()
-        for encoding in encodings:
-            try:
-                text = content.decode(encoding)
+    # 编码检测后按行块流式排版，不再整文件解码成一个大字符串
+    encoding = detect_encoding(txt_path)
+    with open(txt_path, encoding=encoding, errors='replace') as f:
+        while True:
+            block = "".join(islice(f, LINES_PER_BLOCK))
+            if not block:
                 break
-            except UnicodeDecodeError:
-                continue
-        else:
-            text = content.decode('utf-8', errors='replace')
-
-    pdf.multi_cell(0, 10, txt=text, max_line_height=pdf.font_size * 1.5)
+            # 块末换行由下一次 multi_cell 换行体现，去掉以免多出空行
+            if block.endswith("\n"):
+                block = block[:-1]
+            pdf.multi_cell(0, 10, text=block, max_line_height=pdf.font_size * 1.5,
+                           new_x="LMARGIN", new_y="NEXT")
     pdf.output(pdf_path)
 
 
-def main():
-    # 获取用户输入路径
-    root_folder = input("请输入根文件夹路径：").strip()
-
-    if not os.path.isdir(root_folder):
-        print("错误：路径不存在或不是文件夹")
-        return
+def convert_job(job):
+    """进程池任务：转换单个文件，返回 (任务, 错误信息)，成功时错误信息为None"""
+    txt_path, pdf_path = job
+    try:
+        convert_txt_to_pdf(txt_path, pdf_path)
+        return job, None
+    except Exception as e:
+        return job, str(e)
 
-    # 创建PDF输出目录
-    output_dir = os.path.join(root_folder, "PDF输出")
-    os.makedirs(output_dir, exist_ok=True)
 
+def iter_jobs(root_folder, output_dir):
+    """边遍历边产出 (txt路径, pdf路径)，编号依赖遍历顺序，在主进程按os.walk顺序分配"""
     # 使用字典跟踪父文件夹的文件计数
     folder_counter = {}
 
-    # 遍历所有子文件夹
+    in_output_dir = within_dirs(output_dir)
     for root, dirs, files in os.walk(root_folder):
-        # 跳过输出目录
-        if os.path.abspath(root).startswith(os.path.abspath(output_dir)):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
             continue
 
         for file in files:
@@ -108,15 +164,30 @@ def main():
                     pdf_name = f"{base_name}_{folder_counter[base_name] - 1}.pdf"
 
                 # 完整输出路径
-                pdf_path = os.path.join(output_dir, pdf_name)
-
-                try:
-                    convert_txt_to_pdf(txt_path, pdf_path)
-                    rel_path = os.path.relpath(txt_path, root_folder)
-                    print(f"✅ 转换成功：{rel_path} → {pdf_name}")
-                except Exception as e:
-                    rel_path = os.path.relpath(txt_path, root_folder)
-                    print(f"❌ 转换失败：{rel_path} - {str(e)}")
+                yield txt_path, os.path.join(output_dir, pdf_name)
+
+
+def main():
+    # 获取用户输入路径
+    root_folder = input("请输入根文件夹路径：").strip()
+
+    if not os.path.isdir(root_folder):
+        print("错误：路径不存在或不是文件夹")
+        return
+
+    # 创建PDF输出目录
+    output_dir = os.path.join(root_folder, "PDF输出")
+    os.makedirs(output_dir, exist_ok=True)
+
+    # 各文件相互独立，使用进程池并行转换；任务边遍历边提交，不必等整棵目录树扫描完
+    # 结果按提交顺序在主进程打印
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for (txt_path, pdf_path), error in pool.map(convert_job, iter_jobs(root_folder, output_dir), chunksize=4):
+            rel_path = os.path.relpath(txt_path, root_folder)
+            if error is None:
+                print(f"✅ 转换成功：{rel_path} → {os.path.basename(pdf_path)}")
+            else:
+                print(f"❌ 转换失败：{rel_path} - {error}")
 
 
 if __name__ == "__main__":
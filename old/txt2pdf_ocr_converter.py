@@ -4,17 +4,40 @@ txt2pdf_ocr_final.py
 """
 import logging
 import os
-import re
+import queue
 import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 from PIL import Image
 import pytesseract
 from fpdf import FPDF
 
+# old/ 下的脚本单独运行，需把上级目录加入搜索路径以复用公共模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from walk_utils import within_dirs  # noqa: E402
+
+# 须在加载Tesseract前设置：每次识别只用单线程，由外层线程/进程池提供并行度
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+# tesserocr 在进程内调用 Tesseract API，只初始化一次；未安装时退回 pytesseract
+try:
+    from tesserocr import PyTessBaseAPI, PSM
+except ImportError:
+    PyTessBaseAPI = None
+
 # 全局配置
 DEFAULT_FONT_SIZE = 12
 MAX_PAGE_WIDTH = 190  # 单位：mm
 LOG_FILE = "pdf_conversion.log"
 SUPPORTED_IMG_EXTS = ('.png', '.jpg', '.jpeg')
+OCR_THREADS = 2  # 每个转换进程内的OCR线程数（各持有一个 Tesseract API）
+MIN_THREADED_IMAGES = 3  # 图片少于此数时不启用线程池
+# 进程数 × OCR线程数 ≈ CPU核数；无 tesserocr 时进程内不开OCR线程，每核一个进程
+PDF_WORKERS = max(1, (os.cpu_count() or 1) // OCR_THREADS if PyTessBaseAPI is not None else (os.cpu_count() or 1))
+
+# 文件名清洗
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
 
 
 def setup_logging():
@@ -31,11 +54,39 @@ def setup_logging():
 
 def sanitize_filename(name):
     """生成安全文件名"""
-    return re.sub(r'[\\/*?:"<>|]', "-", name.strip())[:100]
+    return name.strip().translate(INVALID_FILENAME_TABLE)[:100]
 
 
 class AdvancedPDFConverter:
     def __init__(self):
+        self.pdf = None
+        self.fonts_loaded = []
+        self._font_configs = None
+        self._apis = None
+        self._ocr_pool = None
+        if PyTessBaseAPI is not None:
+            # Tesseract API 不可跨线程共用：每个线程从队列借用一个实例
+            self._apis = queue.Queue()
+            for _ in range(OCR_THREADS):
+                self._apis.put(PyTessBaseAPI(lang='chi_sim+eng', psm=PSM.AUTO))
+            self._ocr_pool = ThreadPoolExecutor(max_workers=OCR_THREADS)
+        self.reset()
+
+    def close(self):
+        """释放 Tesseract API 与OCR线程池"""
+        if getattr(self, "_ocr_pool", None) is not None:
+            self._ocr_pool.shutdown()
+            self._ocr_pool = None
+        if getattr(self, "_apis", None) is not None:
+            while not self._apis.empty():
+                self._apis.get_nowait().End()
+            self._apis = None
+
+    def __del__(self):
+        self.close()
+
+    def reset(self):
+        """换用新的PDF文档，以便同一转换器处理下一个文件"""
         self.pdf = FPDF()
         self.fonts_loaded = []
         self._initialize_document()
@@ -69,18 +120,21 @@ class AdvancedPDFConverter:
             }
         ]
 
-        for config in font_configs:
-            if os.path.exists(config["path"]):
-                try:
-                    self.pdf.add_font(
-                        family=config["name"],
-                        style=config["style"],
-                        fname=config["path"],
-                        uni=True
-                    )
-                    self.fonts_loaded.append(config["name"])
-                except Exception as e:
-                    logging.warning(f"字体加载失败 {config['name']}: {str(e)}")
+        # 可用字体只检测一次；fpdf2 输出时会原地子集化字体对象，故每个文档仍需重新注册
+        if self._font_configs is None:
+            self._font_configs = [config for config in font_configs if os.path.exists(config["path"])]
+
+        for config in self._font_configs:
+            try:
+                self.pdf.add_font(
+                    family=config["name"],
+                    style=config["style"],
+                    fname=config["path"],
+                    uni=True
+                )
+                self.fonts_loaded.append(config["name"])
+            except Exception as e:
+                logging.warning(f"字体加载失败 {config['name']}: {str(e)}")
 
     def _set_default_font(self):
         """设置回退字体"""
@@ -89,20 +143,71 @@ class AdvancedPDFConverter:
         else:
             self.pdf.set_font("helvetica", size=DEFAULT_FONT_SIZE)
 
+    def _ocr_image(self, img_path):
+        """借用一个 Tesseract API 识别单张图片（识别期间释放GIL）"""
+        api = self._apis.get()
+        try:
+            with Image.open(img_path) as img:
+                api.SetImage(img)
+                return api.GetUTF8Text()
+        finally:
+            self._apis.put(api)
+
+    def _ocr_api(self, folder_path, files):
+        """进程内识别（复用已初始化的 Tesseract API），图片较多时多线程并行，结果保持原顺序"""
+        paths = [os.path.join(folder_path, file) for file in files]
+        if len(paths) < MIN_THREADED_IMAGES:
+            return [self._ocr_image(path) for path in paths]
+        return list(self._ocr_pool.map(self._ocr_image, paths))
+
+    def _ocr_batch(self, folder_path, files):
+        """一次tesseract调用识别全部图片：以图片列表文件作输入，各页结果以换页符分隔"""
+        list_file = tempfile.NamedTemporaryFile('w', suffix='.txt', encoding='utf-8', delete=False)
+        try:
+            with list_file:
+                list_file.write("\n".join(os.path.join(folder_path, file) for file in files))
+            pages = pytesseract.image_to_string(list_file.name, lang='chi_sim+eng').split('\f')
+        finally:
+            os.remove(list_file.name)
+
+        # 有图片读取失败时页数对不上，无法按顺序对应
+        if len(pages) < len(files):
+            raise ValueError(f"识别结果页数不足：{len(pages)} < {len(files)}")
+        return pages[:len(files)]
+
     def _process_images(self, folder_path):
         """处理图片OCR识别"""
-        ocr_results = []
-        for file in sorted(os.listdir(folder_path)):
-            if file.lower().endswith(SUPPORTED_IMG_EXTS):
-                img_path = os.path.join(folder_path, file)
+        with os.scandir(folder_path) as it:
+            files = sorted(
+                entry.name for entry in it
+                if entry.name.lower().endswith(SUPPORTED_IMG_EXTS) and entry.is_file()
+            )
+        if not files:
+            return ""
+
+        try:
+            if self._apis is not None:
+                texts = self._ocr_api(folder_path, files)
+            else:
+                texts = self._ocr_batch(folder_path, files)
+        except Exception as e:
+            logging.warning(f"批量OCR失败，改为逐张识别 {folder_path}: {str(e)}")
+            texts = []
+            for file in files:
                 try:
-                    text = pytesseract.image_to_string(
-                        Image.open(img_path),
+                    texts.append(pytesseract.image_to_string(
+                        Image.open(os.path.join(folder_path, file)),
                         lang='chi_sim+eng'
-                    )
-                    ocr_results.append(f"\n[图片内容识别：{file}]\n{text.strip()}\n")
+                    ))
                 except Exception as e:
                     logging.error(f"OCR处理失败 {file}: {str(e)}")
+                    texts.append(None)
+
+        ocr_results = [
+            f"\n[图片内容识别：{file}]\n{text.strip()}\n"
+            for file, text in zip(files, texts)
+            if text is not None
+        ]
         return "\n".join(ocr_results)
 
     def _smart_line_break(self, text):
@@ -111,43 +216,65 @@ class AdvancedPDFConverter:
         paragraphs = content.split('\n')
 
         for para in paragraphs:
-            # 预计算自动换行
-            lines = self.pdf.multi_cell(
+            # 一次 multi_cell 完成换行与写入，不再先试排再逐行输出
+            self.pdf.multi_cell(
                 w=MAX_PAGE_WIDTH - 20,
                 h=10,
                 text=para,
-                dry_run=True,
-                output="LINES"
+                new_x="LMARGIN",
+                new_y="NEXT"
             )
-
-            # 逐行写入
-            for line in lines:
-                self.pdf.cell(0, 10, line, new_x="LMARGIN", new_y="NEXT")
             self.pdf.ln(3)  # 段落间距
 
     def generate_pdf(self, text_content, image_folder, output_path):
         """生成PDF主流程"""
-        # 添加OCR文本
+        # 正文与OCR文本分别排版，不再拼接出一份完整副本
         ocr_text = self._process_images(image_folder)
-        full_content = f"{text_content}\n{ocr_text}"
-
-        # 排版内容
-        self._smart_line_break(full_content)
+        self._smart_line_break(text_content)
+        if ocr_text:
+            self._smart_line_break(ocr_text)
 
         # 输出文件
         self.pdf.output(output_path)
         logging.info(f"PDF生成成功：{output_path}")
 
 
-def process_files(root_folder, output_dir):
-    """深度递归文件处理器"""
-    processed_count = 0
-    error_count = 0
+def init_worker():
+    """进程池子进程初始化日志"""
+    setup_logging()
+
+
+@lru_cache(maxsize=1)
+def get_converter():
+    """进程内复用的转换器"""
+    return AdvancedPDFConverter()
+
+
+def convert_one(job):
+    """转换单个文件（进程池任务），返回是否成功"""
+    txt_path, root, output_path = job
+    try:
+        with open(txt_path, 'rb') as f:
+            text_content = f.read().decode('utf-8', errors='replace')
+
+        converter = get_converter()
+        converter.reset()
+        converter.generate_pdf(text_content, root, output_path)
+        return True
+    except Exception as e:
+        logging.error(f"处理失败 {txt_path} | 错误类型：{type(e).__name__} | 详细信息：{str(e)}")
+        return False
+
+
+def iter_jobs(root_folder, output_dir):
+    """边遍历边产出 (txt路径, 图片目录, 输出路径)，输出路径在主进程按遍历顺序分配"""
+    claimed = set()  # 本次运行已分配的输出路径（并行转换时文件尚未写出）
 
-    # 使用广度优先遍历提高深层目录处理效率
+    in_output_dir = within_dirs(output_dir)
     for root, dirs, files in os.walk(root_folder, topdown=True):
-        # 跳过输出目录
-        if os.path.abspath(root).startswith(os.path.abspath(output_dir)):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
             continue
 
         # 处理当前目录文件
@@ -155,37 +282,36 @@ def process_files(root_folder, output_dir):
             if filename.lower().endswith('.txt'):
                 txt_path = os.path.join(root, filename)
 
-                try:
-                    # 生成安全输出路径（保留完整目录结构）
-                    rel_path = os.path.relpath(root, root_folder)
-                    safe_path = "_".join([
-                        sanitize_filename(p)
-                        for p in rel_path.split(os.sep)
-                        if p not in ('', '.')
-                    ])
-                    safe_filename = sanitize_filename(os.path.splitext(filename)[0])
-                    output_name = f"{safe_path}_{safe_filename}.pdf" if safe_path else f"{safe_filename}.pdf"
-                    output_path = os.path.join(output_dir, output_name)
-
-                    # 避免文件覆盖
-                    if os.path.exists(output_path):
-                        version = 1
-                        while os.path.exists(f"{output_path}.{version}"):
-                            version += 1
-                        output_path = f"{output_path}.{version}"
-
-                    # 执行转换
-                    with open(txt_path, 'rb') as f:
-                        text_content = f.read().decode('utf-8', errors='replace')
-
-                    converter = AdvancedPDFConverter()
-                    converter.generate_pdf(text_content, root, output_path)
-                    processed_count += 1
+                # 生成安全输出路径（保留完整目录结构）
+                rel_path = os.path.relpath(root, root_folder)
+                safe_path = "_".join([
+                    sanitize_filename(p)
+                    for p in rel_path.split(os.sep)
+                    if p not in ('', '.')
+                ])
+                safe_filename = sanitize_filename(os.path.splitext(filename)[0])
+                output_name = f"{safe_path}_{safe_filename}.pdf" if safe_path else f"{safe_filename}.pdf"
+                output_path = os.path.join(output_dir, output_name)
 
-                except Exception as e:
-                    error_count += 1
-                    logging.error(f"处理失败 {txt_path} | 错误类型：{type(e).__name__} | 详细信息：{str(e)}")
-                    continue
+                # 避免文件覆盖
+                if os.path.exists(output_path) or output_path in claimed:
+                    version = 1
+                    while os.path.exists(f"{output_path}.{version}") or f"{output_path}.{version}" in claimed:
+                        version += 1
+                    output_path = f"{output_path}.{version}"
+                claimed.add(output_path)
+
+                yield txt_path, root, output_path
+
+
+def process_files(root_folder, output_dir):
+    """深度递归文件处理器"""
+    # 各文件相互独立且为CPU密集型（排版、OCR），使用进程池并行转换
+    # 任务边遍历边提交，不必等整棵目录树扫描完
+    with ProcessPoolExecutor(max_workers=PDF_WORKERS, initializer=init_worker) as pool:
+        results = list(pool.map(convert_one, iter_jobs(root_folder, output_dir), chunksize=4))
+    processed_count = sum(results)
+    error_count = len(results) - processed_count
 
     # 生成总结报告
     logging.info(f"处理完成 | 成功：{processed_count} | 失败：{error_count}")
@@ -8,15 +8,18 @@ txt2pdf_converter.py
 - 视频文件检测
 - 防重复转换
 """
+import io
 import logging
 import os
 import re
 import sys
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from datetime import datetime
 from fpdf import FPDF
-from fontTools.ttLib import TTFont
-from PIL import Image
+from font_utils import TEXT_FONT_CANDIDATES, FontRoutingMixin
+from image_utils import IMAGE_DPI, compress_image, get_image_executor, log_image_backend
+from walk_utils import parallel_walk, within_dirs
 
 # 配置参数
 DEFAULT_FONT_SIZE = 12
@@ -26,6 +29,10 @@ SUPPORTED_IMAGE_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 VIDEO_EXT = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
 LOG_FILE = "conversion.log"
 
+# 预编译正则（文件名清洗）
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
+CONTROL_WHITESPACE_RE = re.compile(r'[\t\n\r\f\v]+')
+
 
 def setup_logging():
     """初始化日志记录"""
@@ -47,25 +54,35 @@ def setup_logging():
 
 def sanitize_filename(name):
     """生成安全文件名（保留中日文字符）"""
-    clean_name = re.sub(r'[\\/*?:"<>|]', "-", name)
-    clean_name = re.sub(r'[\t\n\r\f\v]+', '_', clean_name)
+    clean_name = name.translate(INVALID_FILENAME_TABLE)
+    # 控制字符很少出现，全部可打印时跳过正则
+    if not clean_name.isprintable():
+        clean_name = CONTROL_WHITESPACE_RE.sub('_', clean_name)
     return clean_name[:120]
 
 
-class FileOutput:
-    """虚拟输出用于计算换行"""
-
-    def write(self, data):
-        pass
-
+class PDFConverter(FontRoutingMixin):
+    FONT_CANDIDATES = TEXT_FONT_CANDIDATES
 
-class PDFConverter:
-    def __init__(self, compress_ratio=0.8, jpeg_quality=95):  # 调整压缩参数
-        self.pdf = FPDF()
-        self.current_font = None
-        self.available_fonts = []
+    def __init__(self, compress_ratio=0.8, jpeg_quality=95, chroma_subsampling=2, jpeg_optimize=False):  # 调整压缩参数
+        self.pdf = None
+        self._reset_fonts()
         self.compress_ratio = compress_ratio  # 提高压缩比例
         self.jpeg_quality = jpeg_quality  # 提高JPEG质量
+        # JPEG色度抽样：2=4:2:0（照片肉眼无差别，体积约减半），截图含彩色文字时可设0（4:4:4）
+        self.chroma_subsampling = chroma_subsampling
+        # 是否做第二遍霍夫曼优化：缩小到2x2网格后体积收益很小，默认关闭以省去一次编码
+        self.jpeg_optimize = jpeg_optimize
+        # 上一次排版的图片目录及其压缩结果：同一目录的多个txt共用图片，不再重复编码
+        self._image_folder = None
+        self._image_futures = []
+        self.reset()
+
+    def reset(self):
+        """换用新的PDF文档，以便同一转换器处理下一个文件"""
+        # fpdf2 输出时会原地子集化字体对象，故每个文档仍需重新注册字体；字符表由 load_font_cmap 缓存
+        self.pdf = FPDF()
+        self._reset_fonts()
         self._init_pdf()
 
     def _init_pdf(self):
@@ -76,93 +93,50 @@ class PDFConverter:
         self._load_fonts()
 
     def _load_fonts(self):
-        """加载系统字体并排序"""
-        font_paths = [
-            ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
-            ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
-            ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
-            ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
-            ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf"))
-        ]
-
-        for name, path in font_paths:
-            if os.path.exists(path):
-                try:
-                    self.pdf.add_font(name, "", path, uni=True)
-                    self.available_fonts.append(name)
-                except Exception as e:
-                    logging.warning(f"字体加载失败：{name} - {str(e)}")
-
-        if not self.available_fonts:
+        """加载系统字体并排序：只注册主字体，其余字体在文本用到时再注册"""
+        self._collect_fonts()
+
+        # 主字体：按优先级取第一个能成功注册的字体
+        self.current_font = self._primary_font()
+        if self.current_font is None:
             self.pdf.add_font("Arial", "", "arial", uni=True)
             self.available_fonts.append("Arial")
+            self._registered_fonts.add("Arial")
+            self.current_font = "Arial"
 
-        self.current_font = self.available_fonts[0]
         self.pdf.set_font(self.current_font, size=DEFAULT_FONT_SIZE)
 
-    def _handle_unicode_char(self, char):
-        """智能字体切换"""
-        original_font = self.current_font
-        for font in self.available_fonts:
-            try:
-                self.pdf.set_font(font)
-                self.pdf.get_string_width(char)
-                self.current_font = font
-                return True
-            except RuntimeError:
-                continue
-        self.pdf.set_font(original_font)
-        return False
-
     def add_text(self, text):
-        """精确换行文本处理"""
+        """按段落排版文本（由fpdf2完成自动换行）"""
         self.pdf.start_section("")
-        paragraphs = text.split('\n')
-
-        for para in paragraphs:
-            lines = self.pdf.multi_cell(
-                w=MAX_PAGE_WIDTH - 20,
-                h=10,
-                txt=para,
-                split_only=True,
-                output=FileOutput()
-            )
-
-            for line in lines:
-                current_line = []
-                current_width = 0
-
-                for char in line.strip('\r'):
-                    if not self._handle_unicode_char(char):
-                        char = '�'
-
-                    char_width = self.pdf.get_string_width(char)
-
-                    if current_width + char_width > MAX_PAGE_WIDTH - 20:
-                        self.pdf.cell(current_width, 10, ''.join(current_line))
-                        self.pdf.ln()
-                        current_line = [char]
-                        current_width = char_width
-                    else:
-                        current_line.append(char)
-                        current_width += char_width
-
-                if current_line:
-                    self.pdf.cell(current_width, 10, ''.join(current_line))
-                    self.pdf.ln()
-
+        self.pdf.set_font(self.current_font)  # 恢复常规字形（标题可能设为粗体）
+
+        for para in self._sanitize_text(text).split('\n'):
+            if para:
+                self.pdf.multi_cell(
+                    w=MAX_PAGE_WIDTH - 20,
+                    h=10,
+                    text=para,
+                    new_x="LMARGIN",
+                    new_y="NEXT",
+                    wrapmode="CHAR"  # 按字符换行（中文无空格分词），与逐字排版一致
+                )
             self.pdf.ln(3)
 
     def add_images(self, image_folder):
         """优化后的图片处理（2x2布局）"""
-        images = sorted(
-            [f for f in os.listdir(image_folder) if f.lower().endswith(SUPPORTED_IMAGE_EXT)],
-            key=lambda x: os.path.splitext(x)[0]
-        )
-
-        if not images:
-            return
+        if image_folder == self._image_folder:
+            images = None
+        else:
+            with os.scandir(image_folder) as it:
+                images = sorted(
+                    [entry.name for entry in it
+                     if entry.name.lower().endswith(SUPPORTED_IMAGE_EXT) and entry.is_file()],
+                    key=lambda x: os.path.splitext(x)[0]
+                )
+
+            if not images:
+                return
 
         # 新版布局参数
         IMAGES_PER_PAGE = 4  # 改为4张/页
@@ -178,92 +152,80 @@ class PDFConverter:
         page_height_avail = MAX_PAGE_HEIGHT - MARGIN_Y - 15
         cell_height = (page_height_avail - (ROWS - 1) * SPACING) / ROWS
 
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                for i, img_file in enumerate(images):
-                    # 分页控制
-                    if i % IMAGES_PER_PAGE == 0:
-                        self.pdf.add_page()
-
-                    # 计算位置（新版布局计算）
-                    position = i % IMAGES_PER_PAGE
-                    row = position // COLS
-                    col = position % COLS
-                    x = MARGIN_X + col * (cell_width + SPACING)
-                    y = MARGIN_Y + row * (cell_height + SPACING)
-
-                    # 图片处理流程
-                    img_path = os.path.join(image_folder, img_file)
-                    temp_path = os.path.join(temp_dir, f"compressed_{i}.jpg")
-
-                    with Image.open(img_path) as img:
-                        # 保留透明度通道
-                        if img.mode == 'RGBA':
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[3])
-                            img = background
-
-                        # 优化压缩逻辑
-                        if self.compress_ratio < 1:
-                            new_size = (
-                                int(img.width * self.compress_ratio),
-                                int(img.height * self.compress_ratio)
-                            )
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-                        # 高质量保存
-                        img.save(
-                            temp_path,
-                            quality=self.jpeg_quality,
-                            optimize=True,
-                            subsampling=0  # 关闭色度抽样
-                        )
-
-                    # 精确计算显示尺寸
-                    with Image.open(temp_path) as compressed_img:
-                        # 转换为毫米单位
-                        mm_width = compressed_img.width * 0.264583
-                        mm_height = compressed_img.height * 0.264583
-
-                        # 自适应缩放（使用全部空间）
-                        width_ratio = cell_width / mm_width
-                        height_ratio = cell_height / mm_height
-                        scale_ratio = min(width_ratio, height_ratio)
-
-                        # 应用最佳缩放
-                        scaled_width = mm_width * scale_ratio
-                        scaled_height = mm_height * scale_ratio
-                        x_offset = (cell_width - scaled_width) / 2
-                        y_offset = (cell_height - scaled_height) / 2
-
-                        # 添加高精度图片
-                        self.pdf.image(
-                            temp_path,
-                            x=x + x_offset,
-                            y=y + y_offset,
-                            w=scaled_width,
-                            h=scaled_height,
-                            keep_aspect_ratio=True
-                        )
-
-            except Exception as e:
-                logging.error(f"图片处理异常: {str(e)}")
+        # 压缩在线程池中并发进行；FPDF非线程安全，排版仍按顺序在当前线程完成
+        if images is None:
+            futures = self._image_futures  # 与上一个文件同目录，直接复用压缩结果
+        else:
+            self._image_folder, self._image_futures = None, []
+            executor = get_image_executor()
+            futures = [
+                executor.submit(
+                    compress_image,
+                    os.path.join(image_folder, img_file),
+                    self.compress_ratio,
+                    self.jpeg_quality,
+                    self.chroma_subsampling,
+                    self.jpeg_optimize,
+                    (cell_width / 25.4 * IMAGE_DPI, cell_height / 25.4 * IMAGE_DPI)
+                )
+                for img_file in images
+            ]
+        completed = False
+        try:
+            for i, future in enumerate(futures):
+                # 分页控制
+                if i % IMAGES_PER_PAGE == 0:
+                    self.pdf.add_page()
+
+                # 计算位置（新版布局计算）
+                position = i % IMAGES_PER_PAGE
+                row = position // COLS
+                col = position % COLS
+                x = MARGIN_X + col * (cell_width + SPACING)
+                y = MARGIN_Y + row * (cell_height + SPACING)
+
+                # 等待该图片压缩完成
+                image = future.result()
+                if isinstance(image, io.BytesIO):
+                    image.seek(0)  # 复用时从头读取
+
+                # 添加高精度图片：由fpdf2按原比例缩放至单元格内并居中
+                self.pdf.image(
+                    image,
+                    x=x,
+                    y=y,
+                    w=cell_width,
+                    h=cell_height,
+                    keep_aspect_ratio=True
+                )
+            completed = True
+
+        except Exception as e:
+            logging.error(f"图片处理异常: {str(e)}")
+        finally:
+            if completed:
+                self._image_folder, self._image_futures = image_folder, futures
+            else:
+                # 出错时取消尚未开始的压缩，且不保留结果
+                self._image_folder, self._image_futures = None, []
+                for future in futures:
+                    future.cancel()
 
     def save(self, output_path):
         self.pdf.output(output_path)
 
 
+@lru_cache(maxsize=1)
+def get_converter():
+    """进程内复用的转换器"""
+    return PDFConverter(compress_ratio=0.8, jpeg_quality=95)
+
+
 def convert_file(txt_path, output_dir, root_folder):
     """文件转换流程"""
     try:
-        # 视频文件检测
+        # 生成路径标识（含视频的目录已在遍历时跳过）
         txt_dir = os.path.dirname(txt_path)
-        if any(f.lower().endswith(VIDEO_EXT) for f in os.listdir(txt_dir)):
-            logging.info(f"发现视频文件，跳过目录：{os.path.basename(txt_dir)}")
-            return False
-
-        # 生成路径标识
         relative_path = os.path.relpath(txt_dir, root_folder)
         path_parts = [sanitize_filename(p) for p in relative_path.split(os.sep) if p]
 
@@ -280,9 +242,10 @@ def convert_file(txt_path, output_dir, root_folder):
             return False
 
         # 执行转换
-        converter = PDFConverter(compress_ratio=0.8, jpeg_quality=95)
-        with open(txt_path, "rb") as f:
-            text = f.read().decode('utf-8', errors='replace')
+        converter = get_converter()
+        converter.reset()
+        with open(txt_path, encoding='utf-8', errors='replace', newline='') as f:
+            text = f.read()
 
         converter.add_text(text)
         converter.add_images(txt_dir)
@@ -296,8 +259,31 @@ def convert_file(txt_path, output_dir, root_folder):
         return False
 
 
+def iter_txt_paths(root_folder, output_dir):
+    """并发遍历目录树，边扫描边产出txt路径（跳过输出目录及含视频的目录）"""
+    in_output_dir = within_dirs(output_dir)
+    for root, dirs, files in parallel_walk(root_folder):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
+            continue
+
+        txt_files = [file for file in files if file.lower().endswith(".txt")]
+        if not txt_files:
+            continue
+
+        # 视频文件检测（每个目录只判断一次，复用遍历得到的文件名，不再重复列目录）
+        if any(f.lower().endswith(VIDEO_EXT) for f in files):
+            logging.info(f"发现视频文件，跳过目录：{os.path.basename(root)}")
+            continue
+
+        for file in txt_files:
+            yield os.path.join(root, file)
+
+
 def main():
     setup_logging()
+    log_image_backend()
 
     # root_folder = input("请输入根文件夹路径：").strip()
     # if not os.path.isdir(root_folder):
@@ -308,16 +294,11 @@ def main():
     output_dir = os.path.join(root_folder, "汇总小红书图文PDF输出")
     os.makedirs(output_dir, exist_ok=True)
 
-    processed = 0
-    for root, _, files in os.walk(root_folder):
-        if os.path.abspath(root).startswith(os.path.abspath(output_dir)):
-            continue
-
-        for file in files:
-            if file.lower().endswith(".txt"):
-                txt_path = os.path.join(root, file)
-                if convert_file(txt_path, output_dir, root_folder):
-                    processed += 1
+    # FPDF为纯Python实现，受GIL限制，因此使用进程池；子进程需重新初始化日志
+    # 文本文件边扫描边提交，不必等整棵目录树遍历完（输出文件名只取决于路径，与顺序无关）
+    convert = partial(convert_file, output_dir=output_dir, root_folder=root_folder)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_logging) as pool:
+        processed = sum(pool.map(convert, iter_txt_paths(root_folder, output_dir), chunksize=4))
 
     logging.info(f"处理完成！共转换 {processed} 个文件")
 
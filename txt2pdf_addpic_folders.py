@@ -8,15 +8,18 @@ txt2pdf_converter.py
 - 视频文件检测
 - 防重复转换
 """
+import io
 import logging
 import os
 import re
 import sys
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from datetime import datetime
 from fpdf import FPDF
-from fontTools.ttLib import TTFont
-from PIL import Image
+from font_utils import TEXT_FONT_CANDIDATES, FontRoutingMixin
+from image_utils import IMAGE_DPI, compress_image, get_image_executor, log_image_backend
+from walk_utils import parallel_walk, within_dirs
 
 # 配置参数
 DEFAULT_FONT_SIZE = 12
@@ -26,13 +29,18 @@ SUPPORTED_IMAGE_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 VIDEO_EXT = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.wav')
 LOG_FILE = "conversion.log"
 
+# 预编译正则（文件名清洗）
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
+CONTROL_WHITESPACE_RE = re.compile(r'[\t\n\r\f\v]+')
+USER_ID_RE = re.compile(r'^[^\n]*?/user/profile/([^?\n]+)', re.M)  # 每行取第一个主页链接中的用户ID（至?或行尾）
+
 import os
 import glob
-global user_id_dict  # 声明为全局字典
-user_id_dict = {}
+
 
 def process_folder(folder_path):
-    global user_id_dict  # 必须声明为global
+    """解析赛道目录下的链接文件，返回 用户ID → 赛道 字典"""
+    sector_map = {}
     stats = {
         'total_files': 0,
         'total_urls': 0,
@@ -50,34 +58,25 @@ def process_folder(folder_path):
         sector_name = os.path.splitext(os.path.basename(file_path))[0]
 
         with open(file_path, 'r', encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip()]
-
-        for url in urls:
-            stats['total_urls'] += 1
-            profile_pos = url.find('/user/profile/')
-
-            if profile_pos == -1:  # 无效URL格式
-                stats['failed'] += 1
-                continue
-
-            # 计算ID起始位置
-            id_start = profile_pos + len('/user/profile/')
-            query_start = url.find('?', id_start)
+            text = f.read()
 
-            # 提取用户ID
-            user_id = url[id_start:query_start] if query_start != -1 else url[id_start:]
-
-            if not user_id:  # ID为空的情况
-                stats['failed'] += 1
+        # 整个文件一次正则扫描（C实现），不再逐行 find 切片
+        stats['total_urls'] += sum(1 for line in text.split('\n') if line.strip())
+        for match in USER_ID_RE.finditer(text):
+            user_id = match.group(1).strip()
+            if not user_id:  # ID为空的行计为无效
                 continue
 
             # 更新字典和统计
-            if user_id in user_id_dict:
+            if user_id in sector_map:
                 stats['duplicates'] += 1
             else:
                 stats['success'] += 1
 
-            user_id_dict[user_id] = sector_name  # 始终更新最新赛道名称
+            sector_map[user_id] = sector_name  # 始终更新最新赛道名称
+
+    # 无 /user/profile/ 或ID为空的行视为无效
+    stats['failed'] = stats['total_urls'] - stats['success'] - stats['duplicates']
 
     # 打印统计报告
     print(f"\n{' 统计报告 ':=^40}")
@@ -86,8 +85,9 @@ def process_folder(folder_path):
     print(f"有效URL数量: {stats['success']} 条")
     print(f"无效URL数量: {stats['failed']} 条")
     print(f"重复ID数量: {stats['duplicates']} 次")
-    print(f"唯一ID总数: {len(user_id_dict)} 个")
+    print(f"唯一ID总数: {len(sector_map)} 个")
     print("=" * 40 + "\n")
+    return sector_map
 
 def setup_logging():
     """初始化日志记录"""
@@ -109,25 +109,41 @@ def setup_logging():
 
 def sanitize_filename(name):
     """生成安全文件名（保留中日文字符）"""
-    clean_name = re.sub(r'[\\/*?:"<>|]', "-", name)
-    clean_name = re.sub(r'[\t\n\r\f\v]+', '_', clean_name)
+    clean_name = name.translate(INVALID_FILENAME_TABLE)
+    # 控制字符很少出现，全部可打印时跳过正则
+    if not clean_name.isprintable():
+        clean_name = CONTROL_WHITESPACE_RE.sub('_', clean_name)
     return clean_name[:120]
 
 
-class FileOutput:
-    """虚拟输出用于计算换行"""
+@lru_cache(maxsize=None)
+def ensure_dir(path):
+    """创建输出目录（同一路径在进程内只执行一次makedirs）"""
+    os.makedirs(path, exist_ok=True)
 
-    def write(self, data):
-        pass
 
+class PDFConverter(FontRoutingMixin):
+    FONT_CANDIDATES = TEXT_FONT_CANDIDATES
 
-class PDFConverter:
-    def __init__(self, compress_ratio=0.8, jpeg_quality=95):  # 调整压缩参数
-        self.pdf = FPDF()
-        self.current_font = None
-        self.available_fonts = []
+    def __init__(self, compress_ratio=0.8, jpeg_quality=95, chroma_subsampling=2, jpeg_optimize=False):  # 调整压缩参数
+        self.pdf = None
+        self._reset_fonts()
         self.compress_ratio = compress_ratio  # 提高压缩比例
         self.jpeg_quality = jpeg_quality  # 提高JPEG质量
+        # JPEG色度抽样：2=4:2:0（照片肉眼无差别，体积约减半），截图含彩色文字时可设0（4:4:4）
+        self.chroma_subsampling = chroma_subsampling
+        # 是否做第二遍霍夫曼优化：缩小到2x2网格后体积收益很小，默认关闭以省去一次编码
+        self.jpeg_optimize = jpeg_optimize
+        # 上一次排版的图片目录及其压缩结果：同一目录的多个txt共用图片，不再重复编码
+        self._image_folder = None
+        self._image_futures = []
+        self.reset()
+
+    def reset(self):
+        """换用新的PDF文档，以便同一转换器处理下一个文件"""
+        # fpdf2 输出时会原地子集化字体对象，故每个文档仍需重新注册字体；字符表由 load_font_cmap 缓存
+        self.pdf = FPDF()
+        self._reset_fonts()
         self._init_pdf()
 
     def _init_pdf(self):
@@ -138,93 +154,50 @@ class PDFConverter:
         self._load_fonts()
 
     def _load_fonts(self):
-        """加载系统字体并排序"""
-        font_paths = [
-            ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
-            ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
-            ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
-            ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
-            ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf"))
-        ]
-
-        for name, path in font_paths:
-            if os.path.exists(path):
-                try:
-                    self.pdf.add_font(name, "", path, uni=True)
-                    self.available_fonts.append(name)
-                except Exception as e:
-                    logging.warning(f"字体加载失败：{name} - {str(e)}")
-
-        if not self.available_fonts:
+        """加载系统字体并排序：只注册主字体，其余字体在文本用到时再注册"""
+        self._collect_fonts()
+
+        # 主字体：按优先级取第一个能成功注册的字体
+        self.current_font = self._primary_font()
+        if self.current_font is None:
             self.pdf.add_font("Arial", "", "arial", uni=True)
             self.available_fonts.append("Arial")
+            self._registered_fonts.add("Arial")
+            self.current_font = "Arial"
 
-        self.current_font = self.available_fonts[0]
         self.pdf.set_font(self.current_font, size=DEFAULT_FONT_SIZE)
 
-    def _handle_unicode_char(self, char):
-        """智能字体切换"""
-        original_font = self.current_font
-        for font in self.available_fonts:
-            try:
-                self.pdf.set_font(font)
-                self.pdf.get_string_width(char)
-                self.current_font = font
-                return True
-            except RuntimeError:
-                continue
-        self.pdf.set_font(original_font)
-        return False
-
     def add_text(self, text):
-        """精确换行文本处理"""
+        """按段落排版文本（由fpdf2完成自动换行）"""
         self.pdf.start_section("")
-        paragraphs = text.split('\n')
-
-        for para in paragraphs:
-            lines = self.pdf.multi_cell(
-                w=MAX_PAGE_WIDTH - 20,
-                h=10,
-                txt=para,
-                split_only=True,
-                output=FileOutput()
-            )
-
-            for line in lines:
-                current_line = []
-                current_width = 0
-
-                for char in line.strip('\r'):
-                    if not self._handle_unicode_char(char):
-                        char = '�'
-
-                    char_width = self.pdf.get_string_width(char)
-
-                    if current_width + char_width > MAX_PAGE_WIDTH - 20:
-                        self.pdf.cell(current_width, 10, ''.join(current_line))
-                        self.pdf.ln()
-                        current_line = [char]
-                        current_width = char_width
-                    else:
-                        current_line.append(char)
-                        current_width += char_width
-
-                if current_line:
-                    self.pdf.cell(current_width, 10, ''.join(current_line))
-                    self.pdf.ln()
-
+        self.pdf.set_font(self.current_font)  # 恢复常规字形（标题可能设为粗体）
+
+        for para in self._sanitize_text(text).split('\n'):
+            if para:
+                self.pdf.multi_cell(
+                    w=MAX_PAGE_WIDTH - 20,
+                    h=10,
+                    text=para,
+                    new_x="LMARGIN",
+                    new_y="NEXT",
+                    wrapmode="CHAR"  # 按字符换行（中文无空格分词），与逐字排版一致
+                )
             self.pdf.ln(3)
 
     def add_images(self, image_folder):
         """优化后的图片处理（2x2布局）"""
-        images = sorted(
-            [f for f in os.listdir(image_folder) if f.lower().endswith(SUPPORTED_IMAGE_EXT)],
-            key=lambda x: os.path.splitext(x)[0]
-        )
+        if image_folder == self._image_folder:
+            images = None
+        else:
+            with os.scandir(image_folder) as it:
+                images = sorted(
+                    [entry.name for entry in it
+                     if entry.name.lower().endswith(SUPPORTED_IMAGE_EXT) and entry.is_file()],
+                    key=lambda x: os.path.splitext(x)[0]
+                )
 
-        if not images:
-            return
+            if not images:
+                return
 
         # 新版布局参数
         IMAGES_PER_PAGE = 4  # 改为4张/页
@@ -240,128 +213,112 @@ class PDFConverter:
         page_height_avail = MAX_PAGE_HEIGHT - MARGIN_Y - 15
         cell_height = (page_height_avail - (ROWS - 1) * SPACING) / ROWS
 
-        # 创建临时目录
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                for i, img_file in enumerate(images):
-                    # 分页控制
-                    if i % IMAGES_PER_PAGE == 0:
-                        self.pdf.add_page()
-
-                    # 计算位置（新版布局计算）
-                    position = i % IMAGES_PER_PAGE
-                    row = position // COLS
-                    col = position % COLS
-                    x = MARGIN_X + col * (cell_width + SPACING)
-                    y = MARGIN_Y + row * (cell_height + SPACING)
-
-                    # 图片处理流程
-                    img_path = os.path.join(image_folder, img_file)
-                    temp_path = os.path.join(temp_dir, f"compressed_{i}.jpg")
-
-                    with Image.open(img_path) as img:
-                        # 保留透明度通道
-                        if img.mode == 'RGBA':
-                            background = Image.new('RGB', img.size, (255, 255, 255))
-                            background.paste(img, mask=img.split()[3])
-                            img = background
-
-                        # 优化压缩逻辑
-                        if self.compress_ratio < 1:
-                            new_size = (
-                                int(img.width * self.compress_ratio),
-                                int(img.height * self.compress_ratio)
-                            )
-                            img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-                        # 高质量保存
-                        img.save(
-                            temp_path,
-                            quality=self.jpeg_quality,
-                            optimize=True,
-                            subsampling=0  # 关闭色度抽样
-                        )
-
-                    # 精确计算显示尺寸
-                    with Image.open(temp_path) as compressed_img:
-                        # 转换为毫米单位
-                        mm_width = compressed_img.width * 0.264583
-                        mm_height = compressed_img.height * 0.264583
-
-                        # 自适应缩放（使用全部空间）
-                        width_ratio = cell_width / mm_width
-                        height_ratio = cell_height / mm_height
-                        scale_ratio = min(width_ratio, height_ratio)
-
-                        # 应用最佳缩放
-                        scaled_width = mm_width * scale_ratio
-                        scaled_height = mm_height * scale_ratio
-                        x_offset = (cell_width - scaled_width) / 2
-                        y_offset = (cell_height - scaled_height) / 2
-
-                        # 添加高精度图片
-                        self.pdf.image(
-                            temp_path,
-                            x=x + x_offset,
-                            y=y + y_offset,
-                            w=scaled_width,
-                            h=scaled_height,
-                            keep_aspect_ratio=True
-                        )
-
-            except Exception as e:
-                logging.error(f"图片处理异常: {str(e)}")
+        # 压缩在线程池中并发进行；FPDF非线程安全，排版仍按顺序在当前线程完成
+        if images is None:
+            futures = self._image_futures  # 与上一个文件同目录，直接复用压缩结果
+        else:
+            self._image_folder, self._image_futures = None, []
+            executor = get_image_executor()
+            futures = [
+                executor.submit(
+                    compress_image,
+                    os.path.join(image_folder, img_file),
+                    self.compress_ratio,
+                    self.jpeg_quality,
+                    self.chroma_subsampling,
+                    self.jpeg_optimize,
+                    (cell_width / 25.4 * IMAGE_DPI, cell_height / 25.4 * IMAGE_DPI)
+                )
+                for img_file in images
+            ]
+        completed = False
+        try:
+            for i, future in enumerate(futures):
+                # 分页控制
+                if i % IMAGES_PER_PAGE == 0:
+                    self.pdf.add_page()
+
+                # 计算位置（新版布局计算）
+                position = i % IMAGES_PER_PAGE
+                row = position // COLS
+                col = position % COLS
+                x = MARGIN_X + col * (cell_width + SPACING)
+                y = MARGIN_Y + row * (cell_height + SPACING)
+
+                # 等待该图片压缩完成
+                image = future.result()
+                if isinstance(image, io.BytesIO):
+                    image.seek(0)  # 复用时从头读取
+
+                # 添加高精度图片：由fpdf2按原比例缩放至单元格内并居中
+                self.pdf.image(
+                    image,
+                    x=x,
+                    y=y,
+                    w=cell_width,
+                    h=cell_height,
+                    keep_aspect_ratio=True
+                )
+            completed = True
+
+        except Exception as e:
+            logging.error(f"图片处理异常: {str(e)}")
+        finally:
+            if completed:
+                self._image_folder, self._image_futures = image_folder, futures
+            else:
+                # 出错时取消尚未开始的压缩，且不保留结果
+                self._image_folder, self._image_futures = None, []
+                for future in futures:
+                    future.cancel()
 
     def save(self, output_path):
         self.pdf.output(output_path)
 
 
-def convert_file(txt_path, output_dir, root_folder):
-    """文件转换流程"""
-    try:
-        # 视频文件检测
-        txt_dir = os.path.dirname(txt_path)
-        if any(f.lower().endswith(VIDEO_EXT) for f in os.listdir(txt_dir)):
-            logging.info(f"发现视频文件，跳过目录：{os.path.basename(txt_dir)}")
-            return False
-
-        # 生成路径标识
-        relative_path = os.path.relpath(txt_dir, root_folder)
-        path_parts = [sanitize_filename(p) for p in relative_path.split(os.sep) if p]
-
-        # 文件名生成规则
-        base_name = sanitize_filename(os.path.splitext(os.path.basename(txt_path))[0])
-        folder_name = "_".join(path_parts[-3:]) if len(path_parts) >= 3 else "_".join(path_parts) or "root"
-        user_id = path_parts[0].split('_')[1]
-        output_name = f"xhs_图文_{folder_name}_{base_name}.pdf"
-
-        # 这里加一个 if，如果这个 dict 有这个 uid
-        sector = user_id_dict.get(user_id)
-        if sector:
-            print('有赛道：' + sector)
-            output_dir_with_folder = output_dir + '/' + sector + '/' + relative_path.split('/')[1]
-            os.makedirs(output_dir_with_folder, exist_ok=True)
-            output_path = os.path.join(output_dir_with_folder, output_name)
+def compute_output_path(txt_path, output_dir, root_folder, sector_map):
+    """计算txt对应的PDF输出路径（纯计算，不创建目录、不涉及PDF）"""
+    txt_dir = os.path.dirname(txt_path)
 
-        else:
-            print('无赛道' )
-            output_dir_with_folder = output_dir + '/' + relative_path.split('/')[1]
-            os.makedirs(output_dir_with_folder, exist_ok=True)
-            output_path = os.path.join(output_dir_with_folder, output_name)
+    # 生成路径标识
+    relative_path = os.path.relpath(txt_dir, root_folder)
+    path_parts = [sanitize_filename(p) for p in relative_path.split(os.sep) if p]
+
+    # 文件名生成规则
+    base_name = sanitize_filename(os.path.splitext(os.path.basename(txt_path))[0])
+    folder_name = "_".join(path_parts[-3:]) if len(path_parts) >= 3 else "_".join(path_parts) or "root"
+    user_id = path_parts[0].split('_')[1]
+    output_name = f"xhs_图文_{folder_name}_{base_name}.pdf"
+
+    # 该用户有赛道时按赛道分目录
+    sector = sector_map.get(user_id)
+    if sector:
+        output_dir_with_folder = output_dir + '/' + sector + '/' + relative_path.split('/')[1]
+    else:
+        output_dir_with_folder = output_dir + '/' + relative_path.split('/')[1]
+    return os.path.join(output_dir_with_folder, output_name)
 
 
-        # 存在性检查
-        if os.path.exists(output_path):
-            logging.info(f"文件已存在，跳过转换：{output_name}")
-            return False
+@lru_cache(maxsize=1)
+def get_converter():
+    """进程内复用的转换器"""
+    return PDFConverter(compress_ratio=0.8, jpeg_quality=95)
+
+
+def convert_file(txt_path, output_path):
+    """文件转换流程（输出路径已由主进程计算并确认不存在）"""
+    output_name = os.path.basename(output_path)
+    try:
+        ensure_dir(os.path.dirname(output_path))
 
         # 执行转换
-        converter = PDFConverter(compress_ratio=0.8, jpeg_quality=95)
-        with open(txt_path, "rb") as f:
-            text = f.read().decode('utf-8', errors='replace')
+        converter = get_converter()
+        converter.reset()
+        with open(txt_path, encoding='utf-8', errors='replace', newline='') as f:
+            text = f.read()
 
         converter.add_text(text)
-        converter.add_images(txt_dir)
+        converter.add_images(os.path.dirname(txt_path))
         converter.save(output_path)
 
         logging.info(f"转换成功：{output_name}")
@@ -372,25 +329,57 @@ def convert_file(txt_path, output_dir, root_folder):
         return False
 
 
+def convert_job(job):
+    """进程池任务：转换单个 (txt路径, 输出路径)"""
+    return convert_file(*job)
+
+
+def iter_jobs(root_folder, output_dir, sector_map):
+    """并发遍历目录树，边扫描边产出待转换的 (txt路径, 输出路径)；含视频的目录与已有输出在此直接跳过"""
+    in_output_dir = within_dirs(output_dir)
+    for root, dirs, files in parallel_walk(root_folder):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
+            continue
+
+        txt_files = [file for file in files if file.lower().endswith(".txt")]
+        if not txt_files:
+            continue
+
+        # 视频文件检测（每个目录只判断一次，复用遍历得到的文件名）
+        if any(f.lower().endswith(VIDEO_EXT) for f in files):
+            logging.info(f"发现视频文件，跳过目录：{os.path.basename(root)}")
+            continue
+
+        for file in txt_files:
+            txt_path = os.path.join(root, file)
+            try:
+                output_path = compute_output_path(txt_path, output_dir, root_folder, sector_map)
+            except Exception as e:
+                logging.error(f"转换失败：{txt_path} - {str(e)}")
+                continue
+
+            # 存在性检查：重跑时已转换的文件不再提交给进程池
+            if os.path.exists(output_path):
+                logging.info(f"文件已存在，跳过转换：{os.path.basename(output_path)}")
+                continue
+            yield txt_path, output_path
+
+
 def main():
     setup_logging()
+    log_image_backend()
     target_folder = "/Users/penghao/GitHub/Spider_XHS/赛道汇总"
-    process_folder(target_folder)
+    sector_map = process_folder(target_folder)
     root_folder = '/Volumes/PenghaoMac2/XHS data'
 
     output_dir = os.path.join(root_folder, "小红书图文PDF输出")
     os.makedirs(output_dir, exist_ok=True)
 
-    processed = 0
-    for root, _, files in os.walk(root_folder):
-        if os.path.abspath(root).startswith(os.path.abspath(output_dir)):
-            continue
-
-        for file in files:
-            if file.lower().endswith(".txt"):
-                txt_path = os.path.join(root, file)
-                if convert_file(txt_path, output_dir, root_folder):
-                    processed += 1
+    # 各文件相互独立，使用进程池并行转换；输出路径在主进程边扫描边计算，任务随即提交
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_logging) as pool:
+        processed = sum(pool.map(convert_job, iter_jobs(root_folder, output_dir, sector_map), chunksize=4))
 
     logging.info(f"处理完成！共转换 {processed} 个文件")
 
@@ -2,15 +2,19 @@
 txt2pdf_converter.py 最终优化版
 包含所有字体处理改进和错误修复
 """
+import io
 import logging
 import os
 import re
 import sys
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from datetime import datetime
 from fpdf import FPDF
-from fontTools.ttLib import TTFont
 from PIL import Image
+from font_utils import VIDEO_FONT_CANDIDATES, FontRoutingMixin
+from image_utils import log_image_backend
+from walk_utils import within_dirs
 
 # 配置参数
 DEFAULT_FONT_SIZE = 12
@@ -21,6 +25,10 @@ SUPPORTED_IMAGE_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 VIDEO_EXT = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
 LOG_FILE = "conversion.log"
 
+# 预编译正则（文件名清洗）
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
+CONTROL_WHITESPACE_RE = re.compile(r'[\t\n\r\f\v]+')
+
 
 def setup_logging():
     """初始化日志记录"""
@@ -42,23 +50,21 @@ def setup_logging():
 
 def sanitize_filename(name):
     """生成安全文件名（保留中日文字符）"""
-    clean_name = re.sub(r'[\\/*?:"<>|]', "-", name)
-    clean_name = re.sub(r'[\t\n\r\f\v]+', '_', clean_name)
+    clean_name = name.translate(INVALID_FILENAME_TABLE)
+    # 控制字符很少出现，全部可打印时跳过正则
+    if not clean_name.isprintable():
+        clean_name = CONTROL_WHITESPACE_RE.sub('_', clean_name)
     return clean_name[:120]
 
 
-class FileOutput:
-    """虚拟输出用于计算换行"""
-
-    def write(self, data):
-        pass
-
+class PDFConverter(FontRoutingMixin):
+    FONT_CANDIDATES = VIDEO_FONT_CANDIDATES
+    FONT_STYLES = ("", "B")  # 标题使用粗体
+    PREFERRED_FONTS = ("NotoSansCJKsc", "PingFang", "Arial")  # 常用中文字体优先作为主字体
 
-class PDFConverter:
     def __init__(self, compress_ratio=0.8, jpeg_quality=95):
         self.pdf = FPDF()
-        self.current_font = None
-        self.available_fonts = []
+        self._reset_fonts()
         self.compress_ratio = compress_ratio
         self.jpeg_quality = jpeg_quality
         self._init_pdf()
@@ -70,134 +76,69 @@ class PDFConverter:
         self._load_fonts()
 
     def _load_fonts(self):
-        """加载系统字体（macOS优化版）"""
-        font_paths = [
-            ("NotoSansCJKsc", "/System/Library/Fonts/Supplemental/NotoSansCJKsc-Regular.ttf"),
-            ("PingFang", "/System/Library/Fonts/PingFang.ttc"),
-            ("Arial", "/Library/Fonts/Arial.ttf"),
-            ("ArialUnicode", "/System/Library/Fonts/Arial Unicode.ttf"),
-            ("Symbola", "/Library/Fonts/Symbola.ttf"),
-            ("NotoColorEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
-            ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
-            ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
-            ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
-            ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf"))
-        ]
-
-        for font_name, font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    self.pdf.add_font(font_name, style="", fname=font_path, uni=True)
-                    self.pdf.add_font(font_name, style="B", fname=font_path, uni=True)
-                    self.available_fonts.append(font_name)
-                except Exception as e:
-                    logging.warning(f"字体加载失败：{font_name} - {str(e)}")
-                    continue
-
-        self.current_font = next(
-            (f for f in ["NotoSansCJKsc", "PingFang", "Arial"] if f in self.available_fonts),
-            self.available_fonts[0] if self.available_fonts else None
-        )
+        """加载系统字体（macOS优化版）：只注册主字体，其余字体在文本用到时再注册"""
+        self._collect_fonts()
+
+        # 主字体：优先使用常用中文字体，按顺序取第一个能成功注册的字体
+        self.current_font = self._primary_font()
         if self.current_font:
             self.pdf.set_font(self.current_font, size=DEFAULT_FONT_SIZE)
 
-    def _handle_unicode_char(self, char):
-        """智能字体切换（支持回退）"""
-        original_font = self.current_font
-        for font in self.available_fonts:
-            try:
-                self.pdf.set_font(font)
-                self.pdf.get_string_width(char)
-                self.current_font = font
-                return True
-            except RuntimeError:
-                continue
-        self.pdf.set_font(original_font)
-        return False
-
     def add_text(self, text):
-        """精确换行文本处理"""
+        """按段落排版文本（由fpdf2完成自动换行）"""
         self.pdf.set_font_size(CONTENT_FONT_SIZE)  # 使用更大的字体
-        paragraphs = text.split('\n')
-
-        for para in paragraphs:
-            lines = self.pdf.multi_cell(
-                w=MAX_PAGE_WIDTH - 20,
-                h=10,
-                txt=para,
-                split_only=True,
-                output=FileOutput()
-            )
-
-            for line in lines:
-                current_line = []
-                current_width = 0
-
-                for char in line.strip('\r'):
-                    if not self._handle_unicode_char(char):
-                        char = '�'
-
-                    char_width = self.pdf.get_string_width(char)
-
-                    if current_width + char_width > MAX_PAGE_WIDTH - 20:
-                        self.pdf.cell(current_width, 10, ''.join(current_line))
-                        self.pdf.ln()
-                        current_line = [char]
-                        current_width = char_width
-                    else:
-                        current_line.append(char)
-                        current_width += char_width
-
-                if current_line:
-                    self.pdf.cell(current_width, 10, ''.join(current_line))
-                    self.pdf.ln()
-
+        self.pdf.set_font(self.current_font)  # 恢复常规字形（标题可能设为粗体）
+
+        for para in self._sanitize_text(text).split('\n'):
+            if para:
+                self.pdf.multi_cell(
+                    w=MAX_PAGE_WIDTH - 20,
+                    h=10,
+                    text=para,
+                    new_x="LMARGIN",
+                    new_y="NEXT",
+                    wrapmode="CHAR"  # 按字符换行（中文无空格分词），与逐字排版一致
+                )
             self.pdf.ln(3)
 
     def add_cover_image(self, image_path):
         """高清封面处理"""
         try:
-            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                temp_path = tmp.name
-
-                with Image.open(image_path) as img:
+            with Image.open(image_path) as img:
+                # 计算最佳缩放尺寸
+                original_width, original_height = img.size
+                target_width = int(MAX_PAGE_WIDTH * 0.9 * 3.78)  # 90%页面宽度（像素）
+                scaling_factor = min(target_width / original_width, 1.0)  # 不超过原尺寸
+                new_size = (
+                    int(original_width * scaling_factor),
+                    int(original_height * scaling_factor)
+                )
+
+                if scaling_factor == 1.0 and img.format == 'JPEG' and img.mode in ('RGB', 'L'):
+                    # 无需缩放的JPEG直接嵌入，fpdf2 不重新编码
+                    cover = image_path
+                else:
                     # 保持原始色彩模式
                     if img.mode not in ('RGB', 'L'):
                         img = img.convert('RGB')
 
-                    # 计算最佳缩放尺寸
-                    original_width, original_height = img.size
-                    target_width = int(MAX_PAGE_WIDTH * 0.9 * 3.78)  # 90%页面宽度（像素）
-                    scaling_factor = min(target_width / original_width, 1.0)  # 不超过原尺寸
-                    new_size = (
-                        int(original_width * scaling_factor),
-                        int(original_height * scaling_factor)
-                    )
-
-                    # 使用LANCZOS算法保持清晰度
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
+                    # 使用LANCZOS算法保持清晰度；大图先按整数倍快速缩小（reducing_gap），再做最后一段精细重采样
+                    if new_size != img.size:
+                        img = img.resize(new_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
 
-                    # 保存为无损PNG格式
-                    img.save(temp_path, format='PNG', compress_level=0)
+                    # 高质量JPEG写入内存（不经临时文件，体积远小于无损PNG）
+                    cover = io.BytesIO()
+                    img.save(cover, format='JPEG', quality=self.jpeg_quality)
+                    cover.seek(0)
 
-                # 添加到PDF（使用原始尺寸计算毫米单位）
-                self.pdf.add_page()
-                page_width = self.pdf.w - 20  # 留10mm边距
-                x = 10 + (page_width - (new_size[0] / 3.78)) / 2  # 1英寸=25.4mm, 300dpi下1像素≈0.084mm
-                self.pdf.image(temp_path, x=x, y=20, w=new_size[0] / 3.78)  # 精确像素转毫米
-
-                # 移动封面到最后一页
-                if len(self.pdf.pages) > 1:
-                    cover_page = self.pdf.pages.pop()
-                    self.pdf.pages.append(cover_page)
+            # 添加到PDF（使用原始尺寸计算毫米单位）
+            self.pdf.add_page()
+            page_width = self.pdf.w - 20  # 留10mm边距
+            x = 10 + (page_width - (new_size[0] / 3.78)) / 2  # 1英寸=25.4mm, 300dpi下1像素≈0.084mm
+            self.pdf.image(cover, x=x, y=20, w=new_size[0] / 3.78)  # 精确像素转毫米
 
         except Exception as e:
             logging.error(f"封面处理异常: {str(e)}")
-        finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
 
     def add_section_title(self, title):
         """章节标题样式"""
@@ -232,16 +173,16 @@ def convert_video_folder(folder_path, output_dir, root_folder):
         converter.pdf.add_page()
 
         # 添加详情内容
-        with open(required_files['detail.txt'], 'rb') as f:
-            detail_text = f.read().decode('utf-8', errors='replace')
+        with open(required_files['detail.txt'], encoding='utf-8', errors='replace', newline='') as f:
+            detail_text = f.read()
         converter.add_text(detail_text)
 
         # 添加视频文稿（使用更大字体）
         converter.pdf.add_page()
         converter.add_section_title("视频文稿")
         converter.pdf.set_font_size(CONTENT_FONT_SIZE)
-        with open(required_files['audio.txt'], 'rb') as f:
-            audio_text = f.read().decode('utf-8', errors='replace')
+        with open(required_files['audio.txt'], encoding='utf-8', errors='replace', newline='') as f:
+            audio_text = f.read()
         converter.add_text(audio_text)
 
         # 生成输出路径
@@ -265,8 +206,8 @@ def convert_video_folder(folder_path, output_dir, root_folder):
 def convert_normal_txt(txt_path, output_dir, root_folder):
     """普通文本转换"""
     try:
-        with open(txt_path, "rb") as f:
-            text = f.read().decode('utf-8', errors='replace')
+        with open(txt_path, encoding='utf-8', errors='replace', newline='') as f:
+            text = f.read()
 
         converter = PDFConverter()
         converter.pdf.add_page()  # 添加内容页
@@ -294,6 +235,7 @@ def convert_normal_txt(txt_path, output_dir, root_folder):
 
 def main():
     setup_logging()
+    log_image_backend()
 
     # if len(sys.argv) < 2:
     #     root_folder = input("请输入根文件夹路径：").strip()
@@ -312,17 +254,19 @@ def main():
     os.makedirs(output_dir_video, exist_ok=True)
 
     processed_normal = 0
-    processed_video = 0
 
+    # 先收集视频文件夹，再并行转换（各文件夹相互独立，PDF生成为CPU密集型）
+    video_folders = []
+    in_output_dir = within_dirs(output_dir_video)
     for root, dirs, files in os.walk(root_folder):
-        if any(os.path.abspath(root).startswith(os.path.abspath(d)) for d in [ output_dir_video]):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
             continue
 
         # 优先处理视频文件夹
         if any(f.lower().endswith(VIDEO_EXT) for f in files):
-            if convert_video_folder(root, output_dir_video, root_folder):
-                processed_video += 1
-    print(processed_video)
+            video_folders.append(root)
 
         # 处理普通文本文件
         # for file in files:
@@ -330,6 +274,11 @@ def main():
         #         if convert_normal_txt(os.path.join(root, file), output_dir_normal, root_folder):
         #             processed_normal += 1
 
+    # FPDF为纯Python实现，受GIL限制，因此使用进程池；子进程需重新初始化日志
+    convert = partial(convert_video_folder, output_dir=output_dir_video, root_folder=root_folder)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_logging) as pool:
+        processed_video = sum(pool.map(convert, video_folders, chunksize=4))
+
     logging.info(f"\n转换统计：普通文件 {processed_normal} 个，视频文件夹 {processed_video} 个")
 
 
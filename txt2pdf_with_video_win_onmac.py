@@ -2,15 +2,19 @@
 txt2pdf_converter.py 最终优化版
 修复字体设置问题，增强稳定性
 """
+import hashlib
 import logging
 import os
 import re
 import sys
 import tempfile
-import glob
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
 from fpdf import FPDF
-from fontTools.ttLib import TTFont
 from PIL import Image
+from font_utils import VIDEO_FONT_CANDIDATES, FontRoutingMixin
+from image_utils import log_image_backend
+from walk_utils import parallel_walk, within_dirs
 
 # 配置参数
 DEFAULT_FONT_SIZE = 12
@@ -20,6 +24,15 @@ MAX_PAGE_HEIGHT = 270
 SUPPORTED_IMAGE_EXT = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 VIDEO_EXT = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv')
 LOG_FILE = "conversion.log"
+COVER_CACHE_DIR = os.path.join(tempfile.gettempdir(), "pdfc_covers")
+COVER_JPEG_QUALITY = 95  # 封面缓存的JPEG质量（照片封面与无损PNG肉眼无差别，体积小得多）
+DONE_LOG_NAME = ".pdfc_done.txt"  # 断点续跑记录（位于根文件夹下）
+
+# 预编译正则（文件名清洗/数字提取）
+INVALID_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/*?:"<>|', '-'))  # 非法字符替换表，translate 一次完成
+CONTROL_WHITESPACE_RE = re.compile(r'[\t\n\r\f\v]+')
+NUMBER_RE = re.compile(r'(\d+)')
+DATE_SEPARATOR_RE = re.compile(r'[ :.]+')
 
 
 def setup_logging():
@@ -40,21 +53,60 @@ def setup_logging():
 
 def sanitize_filename(name):
     """生成安全文件名（保留中日文字符）"""
-    clean_name = re.sub(r'[\\/*?:"<>|]', "-", name)
-    clean_name = re.sub(r'[\t\n\r\f\v]+', '_', clean_name)
+    clean_name = name.translate(INVALID_FILENAME_TABLE)
+    # 控制字符很少出现，全部可打印时跳过正则
+    if not clean_name.isprintable():
+        clean_name = CONTROL_WHITESPACE_RE.sub('_', clean_name)
     return clean_name[:120]
 
 
-class FileOutput:
-    def write(self, data):
-        pass
+@lru_cache(maxsize=None)
+def ensure_dir(path):
+    """创建输出目录（同一路径在进程内只执行一次makedirs）"""
+    os.makedirs(path, exist_ok=True)
+
 
+@lru_cache(maxsize=512)
+def prepare_cover(image_path, mtime, size):
+    """
+    封面预处理（去透明通道后存为高质量JPEG），按 路径+修改时间+大小 缓存复用
+    返回：(嵌入用的文件路径, 像素宽, 像素高)
+    """
+    with Image.open(image_path) as img:  # 仅解析文件头
+        # RGB/灰度JPEG原图可直接嵌入（fpdf2 不重新编码），无需生成缓存
+        if img.format == 'JPEG' and img.mode in ('RGB', 'L'):
+            return image_path, img.width, img.height
+
+    key = hashlib.sha1(f"{image_path}|{mtime}|{size}".encode('utf-8')).hexdigest()
+    cache_path = os.path.join(COVER_CACHE_DIR, f"{key}.jpg")
+
+    if not os.path.exists(cache_path):
+        os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+        with Image.open(image_path) as img:
+            if img.mode == 'RGBA':
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[3])
+                img = background
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')  # JPEG 不支持的其他模式
+
+            # 先写临时文件再原子替换，避免并发进程读到半成品
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            img.save(tmp_path, 'JPEG', quality=COVER_JPEG_QUALITY)
+            os.replace(tmp_path, cache_path)
+
+    with Image.open(cache_path) as cached:  # 仅解析文件头
+        return cache_path, cached.width, cached.height
+
+
+class PDFConverter(FontRoutingMixin):
+    FONT_CANDIDATES = VIDEO_FONT_CANDIDATES
+    FONT_STYLES = ("", "B")  # 标题使用粗体
+    PREFERRED_FONTS = ("NotoSansCJKsc", "PingFang", "Arial")  # 常用中文字体优先作为主字体
 
-class PDFConverter:
     def __init__(self, compress_ratio=0.8, jpeg_quality=95):
         self.pdf = FPDF()
-        self.current_font = None
-        self.available_fonts = []
+        self._reset_fonts()
         self.compress_ratio = compress_ratio
         self.jpeg_quality = jpeg_quality
         self._init_pdf()
@@ -66,118 +118,49 @@ class PDFConverter:
         self._load_fonts()
 
     def _load_fonts(self):
-        """加载系统字体（macOS优化版）"""
-        font_paths = [
-            ("NotoSansCJKsc", "/System/Library/Fonts/Supplemental/NotoSansCJKsc-Regular.ttf"),
-            ("PingFang", "/System/Library/Fonts/PingFang.ttc"),
-            ("Arial", "/Library/Fonts/Arial.ttf"),
-            ("ArialUnicode", "/System/Library/Fonts/Arial Unicode.ttf"),
-            ("Symbola", "/Library/Fonts/Symbola.ttf"),
-            ("NotoColorEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("NotoEmoji", "/System/Library/Fonts/NotoColorEmoji.ttf"),
-            ("SegoeUIEmoji", "C:/Windows/Fonts/seguiemj.ttf"),
-            ("Symbola", "/usr/share/fonts/truetype/symbola.ttf"),
-            ("PingFang", os.path.expanduser("~/Library/Fonts/PingFang.ttc")),
-            ("STHeiti", os.path.expanduser("~/Library/Fonts/华文黑体.ttf")),
-            ("ArialUnicode", os.path.expanduser("~/Library/Fonts/Arial Unicode.ttf"))
-        ]
-
-        for font_name, font_path in font_paths:
-            if os.path.exists(font_path):
-                try:
-                    self.pdf.add_font(font_name, style="", fname=font_path, uni=True)
-                    self.pdf.add_font(font_name, style="B", fname=font_path, uni=True)
-                    self.available_fonts.append(font_name)
-                except Exception as e:
-                    logging.warning(f"字体加载失败：{font_name} - {str(e)}")
-                    continue
-
-        self.current_font = next(
-            (f for f in ["NotoSansCJKsc", "PingFang", "Arial"] if f in self.available_fonts),
-            self.available_fonts[0] if self.available_fonts else None
-        )
+        """加载系统字体（macOS优化版）：只注册主字体，其余字体在文本用到时再注册"""
+        self._collect_fonts()
+
+        # 主字体：优先使用常用中文字体，按顺序取第一个能成功注册的字体
+        self.current_font = self._primary_font()
         if self.current_font:
             self.pdf.set_font(self.current_font, size=DEFAULT_FONT_SIZE)
 
-    def _handle_unicode_char(self, char):
-        """智能字体切换（支持回退）"""
-        original_font = self.current_font
-        for font in self.available_fonts:
-            try:
-                self.pdf.set_font(font)
-                self.pdf.get_string_width(char)
-                self.current_font = font
-                return True
-            except RuntimeError:
-                continue
-        self.pdf.set_font(original_font)
-        return False
-
     def add_text(self, text):
-        """精确换行文本处理"""
+        """按段落排版文本（由fpdf2完成自动换行）"""
         self.pdf.set_font_size(CONTENT_FONT_SIZE)  # 使用更大的字体
-        paragraphs = text.split('\n')
-
-        for para in paragraphs:
-            lines = self.pdf.multi_cell(
-                w=MAX_PAGE_WIDTH - 20,
-                h=10,
-                text=para,
-                split_only=True,
-                output=FileOutput()
-            )
-
-            for line in lines:
-                current_line = []
-                current_width = 0
-
-                for char in line.strip('\r'):
-                    if not self._handle_unicode_char(char):
-                        char = '�'
-
-                    char_width = self.pdf.get_string_width(char)
-
-                    if current_width + char_width > MAX_PAGE_WIDTH - 20:
-                        self.pdf.cell(current_width, 10, ''.join(current_line))
-                        self.pdf.ln()
-                        current_line = [char]
-                        current_width = char_width
-                    else:
-                        current_line.append(char)
-                        current_width += char_width
-
-                if current_line:
-                    self.pdf.cell(current_width, 10, ''.join(current_line))
-                    self.pdf.ln()
-
+        self.pdf.set_font(self.current_font)  # 恢复常规字形（标题可能设为粗体）
+
+        for para in self._sanitize_text(text).split('\n'):
+            if para:
+                self.pdf.multi_cell(
+                    w=MAX_PAGE_WIDTH - 20,
+                    h=10,
+                    text=para,
+                    new_x="LMARGIN",
+                    new_y="NEXT",
+                    wrapmode="CHAR"  # 按字符换行（中文无空格分词），与逐字排版一致
+                )
             self.pdf.ln(3)
 
     def add_cover_image(self, image_path):
         """增强封面处理功能"""
         logging.info(f"开始处理封面图片：{image_path}")
         try:
-            with Image.open(image_path) as img:
-                # 转换颜色模式并计算尺寸
-                if img.mode == 'RGBA':
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[3])
-                    img = background
-
-                width_mm = img.width * 0.0846  # 像素转毫米（300dpi）
-                height_mm = img.height * 0.0846
+            stat = os.stat(image_path)
+            cover_path, width, height = prepare_cover(image_path, stat.st_mtime, stat.st_size)
 
-                # 创建临时PDF页面
-                self.pdf.add_page(format=(width_mm + 20, height_mm + 20))
-                x = (self.pdf.w - width_mm) / 2
-                y = (self.pdf.h - height_mm) / 2
+            width_mm = width * 0.0846  # 像素转毫米（300dpi）
+            height_mm = height * 0.0846
 
-                # 使用原始尺寸保存临时文件
-                with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp:
-                    img.save(tmp.name, 'PNG', compress_level=0)
-                    self.pdf.image(tmp.name, x=x, y=y, w=width_mm)
+            # 创建临时PDF页面
+            self.pdf.add_page(format=(width_mm + 20, height_mm + 20))
+            x = (self.pdf.w - width_mm) / 2
+            y = (self.pdf.h - height_mm) / 2
+            self.pdf.image(cover_path, x=x, y=y, w=width_mm)
 
-                logging.info(f"封面图片处理成功：{image_path}")
-                return True
+            logging.info(f"封面图片处理成功：{image_path}")
+            return True
 
         except Exception as e:
             logging.error(f"封面处理失败: {str(e)}", exc_info=True)
@@ -199,10 +182,18 @@ class PDFConverter:
 def extract_number(filename):
     """通用数字提取函数"""
     basename = os.path.basename(filename)
-    match = re.search(r'(\d+)', basename)
+    match = NUMBER_RE.search(basename)
     return int(match.group(1)) if match else 0
 
 
+def load_done_folders(log_path):
+    """读取已转换文件夹记录（每行一个绝对路径）"""
+    if not os.path.exists(log_path):
+        return set()
+    with open(log_path, encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+
 def convert_video_folder(folder_path, output_dir, root_folder):
     """
     处理视频文件夹转换的完整函数
@@ -212,18 +203,23 @@ def convert_video_folder(folder_path, output_dir, root_folder):
     """
     try:
         # ===================== 1. 必要文件验证 =====================
+        # 单次扫描目录完成全部文件分类（替代多次glob）
+        with os.scandir(folder_path) as it:
+            entries = [entry for entry in it if entry.is_file()]
+
         detail_path = os.path.join(folder_path, 'detail.txt')
-        if not os.path.exists(detail_path):
+        if not any(entry.name == 'detail.txt' for entry in entries):
             raise FileNotFoundError("缺失detail.txt")
 
         # 获取排序后的文件列表
         audio_files = sorted(
-            glob.glob(os.path.join(folder_path, 'audio_*.txt')),
+            (entry.path for entry in entries
+             if entry.name.startswith('audio_') and entry.name.endswith('.txt')),
             key=extract_number
         )
         cover_files = sorted(
-            [f for ext in SUPPORTED_IMAGE_EXT
-             for f in glob.glob(os.path.join(folder_path, f'cover*{ext}'))],
+            (entry.path for entry in entries
+             if entry.name.startswith('cover') and entry.name.lower().endswith(SUPPORTED_IMAGE_EXT)),
             key=extract_number
         )
 
@@ -234,18 +230,8 @@ def convert_video_folder(folder_path, output_dir, root_folder):
 
         # ===================== 2. 内容读取处理 =====================
         # 读取detail.txt内容（带异常字符处理）
-        with open(detail_path, 'rb') as f:
-            detail_text = f.read().decode('utf-8', errors='replace')
-
-        # 合并音频文稿内容
-        audio_text = []
-        for af in audio_files:
-            try:
-                with open(af, 'rb') as f:
-                    audio_text.append(f.read().decode('utf-8', errors='replace'))
-            except Exception as e:
-                logging.warning(f"音频文件读取失败：{af} - {str(e)}")
-                audio_text.append("[损坏内容]")
+        with open(detail_path, encoding='utf-8', errors='replace', newline='') as f:
+            detail_text = f.read()
 
         # ===================== 3. PDF生成核心 =====================
         converter = PDFConverter()
@@ -259,10 +245,17 @@ def convert_video_folder(folder_path, output_dir, root_folder):
         converter.pdf.add_page()
         converter.add_text(detail_text.strip())
 
-        # 3.3 添加音频文稿
+        # 3.3 添加音频文稿（逐个文件读取并排版，不拼接成一个大字符串）
         converter.pdf.add_page()
         converter.add_section_title("视频完整文稿")
-        converter.add_text('\n'.join(audio_text).strip())
+        for af in audio_files:
+            try:
+                with open(af, encoding='utf-8', errors='replace', newline='') as f:
+                    audio_text = f.read()
+            except Exception as e:
+                logging.warning(f"音频文件读取失败：{af} - {str(e)}")
+                audio_text = "[损坏内容]"
+            converter.add_text(audio_text.strip())
 
         # ===================== 4. 智能路径生成 =====================
         # 4.1 提取路径要素
@@ -279,7 +272,7 @@ def convert_video_folder(folder_path, output_dir, root_folder):
         name_parts = current_folder.split('_', 1)  # 分割日期和标题
 
         # 日期标准化处理（处理 2024-05-21 18.53.55 格式）
-        date_part = re.sub(r'[ :.]+', '-', name_parts[0]) if len(name_parts) > 0 else "无日期"
+        date_part = DATE_SEPARATOR_RE.sub('-', name_parts[0]) if len(name_parts) > 0 else "无日期"
 
         # 标题处理（截断至60字符）
         title_part = name_parts[1] if len(name_parts) > 1 else "无标题"
@@ -287,7 +280,7 @@ def convert_video_folder(folder_path, output_dir, root_folder):
 
         # 4.4 构建最终路径
         output_subdir = os.path.join(output_dir, parent_folder)
-        os.makedirs(output_subdir, exist_ok=True)
+        ensure_dir(output_subdir)
 
         output_name = f"douyin_视频_{parent_folder}_{date_part}_{title_part}.pdf"
         output_path = os.path.join(output_subdir, output_name)
@@ -315,8 +308,8 @@ def convert_video_folder(folder_path, output_dir, root_folder):
 
 def convert_normal_txt(txt_path, output_dir, root_folder):
     try:
-        with open(txt_path, "rb") as f:
-            text = f.read().decode('utf-8', errors='replace')
+        with open(txt_path, encoding='utf-8', errors='replace', newline='') as f:
+            text = f.read()
 
         converter = PDFConverter()
         converter.pdf.add_page()
@@ -343,6 +336,7 @@ def convert_normal_txt(txt_path, output_dir, root_folder):
 
 def main():
     setup_logging()
+    log_image_backend()
 
     if len(sys.argv) < 2:
         root_folder = input("请输入根文件夹路径：").strip()
@@ -361,15 +355,23 @@ def main():
     processed_normal = 0
     processed_video = 0
 
-    for root, dirs, files in os.walk(root_folder):
-        if any(os.path.abspath(root).startswith(os.path.abspath(d))
-               for d in [output_dir_normal, output_dir_video]):
+    # 已完成的文件夹直接跳过，避免重跑时重复生成带序号的PDF
+    done_log = os.path.join(root_folder, DONE_LOG_NAME)
+    done_folders = load_done_folders(done_log)
+
+    # 先收集视频文件夹，再并行转换（各文件夹相互独立，PDF生成为CPU密集型）
+    video_folders = []
+    in_output_dir = within_dirs(output_dir_normal, output_dir_video)
+    for root, dirs, files in parallel_walk(root_folder):
+        # 跳过输出目录（并不再进入其子目录）
+        if in_output_dir(root):
+            dirs[:] = []
             continue
 
         # 处理视频文件夹
         if any(f.lower().endswith(VIDEO_EXT) for f in files):
-            if convert_video_folder(root, output_dir_video, root_folder):
-                processed_video += 1
+            if os.path.abspath(root) not in done_folders:
+                video_folders.append(root)
 
         # 处理普通文本文件
         # for file in files:
@@ -377,6 +379,21 @@ def main():
         #         if convert_normal_txt(os.path.join(root, file), output_dir_normal, root_folder):
         #             processed_normal += 1
 
+    # 固定处理顺序（并发扫描的产出顺序不确定）
+    video_folders.sort()
+    logging.info(f"待转换视频文件夹 {len(video_folders)} 个（续跑记录中已完成 {len(done_folders)} 个）")
+
+    # FPDF为纯Python实现，受GIL限制，因此使用进程池；子进程需重新初始化日志
+    convert = partial(convert_video_folder, output_dir=output_dir_video, root_folder=root_folder)
+    with ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=setup_logging) as pool, \
+            open(done_log, 'a', encoding='utf-8') as log:
+        # 仅主进程写记录；map按提交顺序返回结果
+        for folder, success in zip(video_folders, pool.map(convert, video_folders, chunksize=4)):
+            if success:
+                processed_video += 1
+                log.write(os.path.abspath(folder) + '\n')
+                log.flush()
+
     logging.info(f"\n转换完成：普通文件 {processed_normal} 个，视频文件夹 {processed_video} 个")
 
 
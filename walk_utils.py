@@ -0,0 +1,69 @@
+"""
+walk_utils.py
+目录遍历工具：
+- 多线程并发 scandir，适用于网络卷（SMB/NFS）上的大目录树
+- 产出格式与 os.walk 相同，可直接替换
+- 判断路径是否位于指定目录（如输出目录）之内，用于遍历时剪枝
+"""
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+WALK_THREADS = 16
+
+
+def _scan_dir(path):
+    """扫描单个目录，返回 (path, dirs, files, 需递归的子目录)"""
+    dirs, files, subdirs = [], [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs.append(entry.name)
+                    # 与 os.walk 默认行为一致：不进入符号链接目录
+                    if not entry.is_symlink():
+                        subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+    except OSError as e:
+        logging.warning(f"目录读取失败：{path} - {str(e)}")
+    return path, dirs, files, subdirs
+
+
+def parallel_walk(top, max_workers=WALK_THREADS):
+    """
+    多线程版 os.walk
+    - 按扫描完成顺序产出 (root, dirs, files)，不保证顺序
+    - 与 os.walk(topdown=True) 相同，可在循环中原地修改 dirs 以剪枝
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(_scan_dir, top)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root, dirs, files, subdirs = future.result()
+                yield root, dirs, files
+                kept = set(dirs)
+                for name in subdirs:
+                    if name in kept:
+                        pending.add(pool.submit(_scan_dir, os.path.join(root, name)))
+
+
+def within_dirs(*dirs):
+    """
+    返回判断函数：路径等于 dirs 之一或位于其下时为 True
+    - dirs 只在此规范化一次，循环中每次只规范化被判断的路径
+    - 带分隔符比较，避免误判名称前缀相同的兄弟目录
+    """
+    skip_dirs = tuple(os.path.abspath(d) for d in dirs)
+    skip_prefixes = tuple(d + os.sep for d in skip_dirs)
+
+    def is_within(path):
+        path = os.path.abspath(path)
+        return path in skip_dirs or path.startswith(skip_prefixes)
+
+    return is_within